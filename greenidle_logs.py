@@ -0,0 +1,254 @@
+# greenidle_logs.py
+# =========================================================
+# Journaux bornés de greenidle_server (results, tasks_log).
+# - LogRing : anneau en mémoire des `retention` entrées les plus récentes.
+#   Les entrées évincées sont déversées (spill) par lots dans des segments
+#   gzip JSONL append-only : un fichier par lot, jamais réécrit, nommé
+#   <nom>-<premier seq>-<dernier seq>-<pid>.jsonl.gz.
+# - Chaque entrée porte un "seq" croissant (horodatage ns) qui sert de
+#   curseur : page(before=seq) parcourt l'anneau puis les segments. Les
+#   SEQ_TAG_BITS bits de poids faible portent le numéro du worker (seq_tag) :
+#   deux workers ne produisent jamais le même seq, même à la même ns.
+# - Chaque segment a un sidecar <segment>.keys.json listant les valeurs des
+#   champs indexés (index_fields, ex. job_id / machine_id) : page(where=...)
+#   saute sans les décompresser les segments qui ne peuvent pas correspondre.
+# =========================================================
+
+import atexit
+import gzip
+import heapq
+import json
+import os
+import threading
+import time
+from collections import deque
+
+SPILL_BATCH = 1000  # entrées par segment
+SEQ_TAG_BITS = 10   # bits de poids faible du seq réservés au numéro de worker
+SEGMENT_EXT = ".jsonl.gz"
+KEYS_EXT = ".keys.json"
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"), default=str)
+
+
+class LogRing:
+    """
+    Bounded append-only log. Keeps the last `retention` entries in memory;
+    older ones are written to gzip JSONL segments in `spill_dir` (or dropped
+    when spill_dir is empty). Only entries created by this process are
+    spilled: entries loaded at startup or synced from other workers are
+    already on disk elsewhere.
+    index_fields: entry fields whose distinct values are recorded per segment.
+    """
+
+    def __init__(self, name: str, retention: int, spill_dir: str = "", spill_batch: int = SPILL_BATCH,
+                 index_fields=()):
+        self.name = name
+        self.retention = max(1, int(retention))
+        self.spill_dir = spill_dir
+        self.spill_batch = max(1, int(spill_batch))
+        self.index_fields = tuple(index_fields)
+
+        self.seq_tag = 0  # numéro du worker (cf. SEQ_TAG_BITS), fixé par le serveur
+
+        self._lock = threading.RLock()
+        self._ring = deque()   # (entry, à déverser ?)
+        self._pending = []     # évincées, pas encore écrites
+        self._last_seq = 0
+        self._segments = []    # [(first_seq, last_seq, path)]
+        self._spilled_upto = 0
+        self._segment_keys = {}  # path -> {champ: frozenset(valeurs)} ; None si pas de sidecar
+
+        if spill_dir and os.path.isdir(spill_dir):
+            self._scan_segments()
+        atexit.register(self.close)
+
+    # ---------- segments
+    def _scan_segments(self):
+        prefix = f"{self.name}-"
+        for fn in os.listdir(self.spill_dir):
+            if not (fn.startswith(prefix) and fn.endswith(SEGMENT_EXT)):
+                continue
+            parts = fn[len(prefix):-len(SEGMENT_EXT)].split("-")
+            try:
+                first, last = int(parts[0]), int(parts[1])
+            except (IndexError, ValueError):
+                continue
+            self._segments.append((first, last, os.path.join(self.spill_dir, fn)))
+            self._spilled_upto = max(self._spilled_upto, last)
+        self._segments.sort()
+
+    def _write_segment(self):
+        batch, self._pending = self._pending, []
+        if not batch or not self.spill_dir:
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        first, last = batch[0]["seq"], batch[-1]["seq"]
+        path = os.path.join(self.spill_dir, f"{self.name}-{first:020d}-{last:020d}-{os.getpid()}{SEGMENT_EXT}")
+        if self.index_fields:
+            keys = {f: sorted({e.get(f) for e in batch if isinstance(e.get(f), str)})
+                    for f in self.index_fields}
+            self._write_file(self._keys_path(path), _dumps(keys).encode("utf-8"))
+            self._segment_keys[path] = {f: frozenset(v) for f, v in keys.items()}
+        data = gzip.compress("".join(_dumps(e) + "\n" for e in batch).encode("utf-8"), 6)
+        self._write_file(path, data)
+        self._segments.append((first, last, path))
+        self._spilled_upto = max(self._spilled_upto, last)
+
+    @staticmethod
+    def _write_file(path: str, data: bytes):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)  # un fichier visible est toujours complet
+
+    @staticmethod
+    def _keys_path(path: str) -> str:
+        return path[:-len(SEGMENT_EXT)] + KEYS_EXT
+
+    def _keys(self, path: str):
+        """Indexed values of a segment, from its sidecar (None when absent: read the segment)."""
+        if path not in self._segment_keys:
+            try:
+                with open(self._keys_path(path), encoding="utf-8") as f:
+                    keys = {k: frozenset(v) for k, v in json.load(f).items()}
+            except (OSError, ValueError, TypeError, AttributeError):
+                keys = None
+            self._segment_keys[path] = keys
+        return self._segment_keys[path]
+
+    def _may_match(self, path: str, where: dict) -> bool:
+        keys = self._keys(path)
+        if keys is None:
+            return True
+        return all(v in keys[f] for f, v in where.items() if f in keys)
+
+    @staticmethod
+    def _read_segment(path: str) -> list:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except (OSError, EOFError, ValueError):
+            return []
+
+    def flush(self):
+        """Writes the entries evicted but not yet spilled."""
+        with self._lock:
+            self._write_segment()
+
+    def close(self):
+        """
+        At exit: also spills this process's entries still in the ring. Nobody
+        else would (other workers load them with spill=False, and the store
+        prunes its copy), so a recycled worker would otherwise lose them.
+        """
+        with self._lock:
+            ring = deque()
+            for e, spill in self._ring:
+                if spill and self.spill_dir and e["seq"] > self._spilled_upto:
+                    self._pending.append(e)
+                    spill = False
+                ring.append((e, spill))
+            self._ring = ring
+            self._write_segment()
+
+    # ---------- écriture
+    def _next_seq(self) -> int:
+        # horodatage ns dont les bits bas sont remplacés par seq_tag, strictement croissant
+        ns = max(self._last_seq + 1, time.time_ns())
+        step = 1 << SEQ_TAG_BITS
+        seq = ns - ns % step + self.seq_tag % step
+        if seq < ns:
+            seq += step
+        self._last_seq = seq
+        return seq
+
+    def _push(self, entry: dict, spill: bool):
+        self._ring.append((entry, spill))
+        while len(self._ring) > self.retention:
+            old, old_spill = self._ring.popleft()
+            if old_spill and self.spill_dir:
+                self._pending.append(old)
+                if len(self._pending) >= self.spill_batch:
+                    self._write_segment()
+
+    def append(self, entry: dict) -> int:
+        """Adds a new local entry, stamping entry["seq"]. Returns the seq."""
+        with self._lock:
+            entry["seq"] = self._next_seq()
+            self._push(entry, True)
+            return entry["seq"]
+
+    def extend(self, entries, spill: bool = False):
+        """
+        Adds entries created elsewhere (startup load, other workers).
+        With spill=True, those newer than the last segment are spilled when evicted.
+        """
+        with self._lock:
+            for e in entries:
+                if "seq" not in e:  # ligne antérieure aux seq
+                    e["seq"] = self._next_seq()
+                else:
+                    self._last_seq = max(self._last_seq, int(e["seq"]))
+                self._push(e, spill and e["seq"] > self._spilled_upto)
+
+    # ---------- lecture
+    def __len__(self):
+        return len(self._ring)
+
+    def __iter__(self):
+        with self._lock:
+            return iter([e for e, _ in self._ring])
+
+    def page(self, before: int = None, limit: int = 50, match=None, after: int = None, where: dict = None):
+        """
+        Newest-first page of entries with after < seq < before that satisfy match(entry)
+        and whose fields equal where={field: value}.
+        seq is a ns timestamp, so before/after double as a time range.
+        Returns (rows, next_before); next_before is None on the last page.
+        Segments are read newest first and only while they can still hold a
+        better candidate, so recent pages never touch the disk; with `where`
+        on index_fields, segments whose sidecar lacks the value are skipped.
+        """
+        where = where or {}
+        limit = max(1, int(limit))
+        keep = limit + 1
+        heap, seen = [], set()
+
+        def offer(e):
+            seq = e.get("seq", 0)
+            if (before is not None and seq >= before) or seq in seen:
+                return
+            if after is not None and seq <= after:
+                return
+            if any(e.get(f) != v for f, v in where.items()):
+                return
+            if match is not None and not match(e):
+                return
+            seen.add(seq)
+            if len(heap) < keep:
+                heapq.heappush(heap, (seq, e))
+            elif seq > heap[0][0]:
+                heapq.heapreplace(heap, (seq, e))
+
+        with self._lock:
+            mem = [e for e, _ in self._ring] + list(self._pending)
+            segments = sorted(self._segments, key=lambda s: s[1], reverse=True)
+        for e in mem:
+            offer(e)
+        for first, last, path in segments:
+            if (before is not None and first >= before) or (after is not None and last <= after):
+                continue
+            if len(heap) >= keep and last < heap[0][0]:
+                break
+            if where and not self._may_match(path, where):
+                continue
+            for e in self._read_segment(path):
+                offer(e)
+
+        rows = [e for _, e in sorted(heap, key=lambda x: x[0], reverse=True)]
+        if len(rows) > limit:
+            return rows[:limit], rows[limit - 1]["seq"]
+        return rows, None
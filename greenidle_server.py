@@ -1,17 +1,26 @@
 print(">>> GREENIDLE_SERVER.PY LOADED – MIN-SEC V6 (AUTO-PLUGINS + MULTI-JOBS) <<<")
 
 from flask import (
-    Flask, request, jsonify, render_template_string, redirect, url_for,
+    Flask, request, jsonify, render_template, redirect, url_for,
     abort, send_from_directory
 )
-from datetime import datetime
+from datetime import datetime, timezone
+from collections import deque, OrderedDict
 import uuid
 import os
 import time
 import hmac
 import hashlib
 import json
+import threading
+import heapq
+import bisect
+import gzip
 from functools import wraps
+from contextlib import contextmanager
+
+import greenidle_store
+import greenidle_logs
 
 app = Flask(__name__)
 
@@ -40,33 +49,69 @@ def file_sha256(path: str) -> str:
             h.update(chunk)
     return h.hexdigest()
 
-def list_plugins():
-    items = []
-    try:
-        if not os.path.isdir(PLUGINS_DIR):
-            return items
+# Manifeste en cache : un fichier n'est re-hashé que si (mtime_ns, size) change.
+# Un thread de polling rafraîchit le cache ; 0 = contrôle des stat() à chaque appel.
+PLUGINS_POLL_INTERVAL = float(os.getenv("PLUGINS_POLL_INTERVAL", "2"))
+
+_plugins_lock = threading.Lock()
+_plugin_entries = {}  # name -> {"key": (path, mtime_ns, size), "item": {...}}
+_plugins_manifest = None  # {"items": [...], "body": bytes, "etag": str}
+
+def refresh_plugins() -> bool:
+    """Re-stats server_plugins/, re-hashes changed files only. Returns True if the manifest changed."""
+    global _plugins_manifest
+    with _plugins_lock:
+        seen = {}
+        try:
+            if os.path.isdir(PLUGINS_DIR):
+                for de in os.scandir(PLUGINS_DIR):
+                    if not de.name.endswith(".py") or not de.is_file():
+                        continue
+                    st = de.stat()
+                    key = (de.path, st.st_mtime_ns, st.st_size)
+                    old = _plugin_entries.get(de.name)
+                    if old is None or old["key"] != key:
+                        with open(de.path, "rb") as f:
+                            data = f.read()
+                        sha = hashlib.sha256(data).hexdigest()
+                        old = {"key": key, "data": data, "item": {
+                            "name": de.name,
+                            "bytes": len(data),
+                            "sha256": sha,
+                            "url": f"/plugins/{de.name}",
+                            "url_sha": f"/plugins/by-sha/{sha}"  # contenu figé, cacheable à vie
+                        }}
+                    seen[de.name] = old
+        except Exception:
+            pass
+
+        if _plugins_manifest is not None and seen.keys() == _plugin_entries.keys() and all(
+                seen[n]["key"] == _plugin_entries[n]["key"] for n in seen):
+            return False
+
+        _plugin_entries.clear()
+        _plugin_entries.update(seen)
+        items = [seen[n]["item"] for n in sorted(seen)]
+        body = json.dumps({"count": len(items), "plugins": items}, sort_keys=True).encode("utf-8")
+        _plugins_manifest = {
+            "items": items,
+            "body": body,
+            "etag": hashlib.sha256(body).hexdigest()
+        }
+        return True
 
-        for name in sorted(os.listdir(PLUGINS_DIR)):
-            if not name.endswith(".py"):
-                continue
-            full = os.path.join(PLUGINS_DIR, name)
-            if not os.path.isfile(full):
-                continue
+def plugins_manifest() -> dict:
+    if _plugins_manifest is None or PLUGINS_POLL_INTERVAL <= 0:
+        refresh_plugins()
+    return _plugins_manifest
 
-            items.append({
-                "name": name,
-                "bytes": os.path.getsize(full),
-                "sha256": file_sha256(full),
-                "url": f"/plugins/{name}"
-            })
-    except Exception:
-        pass
-    return items
+def list_plugins():
+    return [dict(p) for p in plugins_manifest()["items"]]
 
 def plugin_types_available():
     """Returns list of plugin type names without .py, ex: ['montecarlo','optimizer_grid']"""
     types = []
-    for p in list_plugins():
+    for p in plugins_manifest()["items"]:
         nm = (p.get("name") or "").strip()
         if nm.endswith(".py"):
             types.append(nm[:-3])
@@ -74,13 +119,92 @@ def plugin_types_available():
 
 @app.route("/plugins.json")
 def plugins_json():
-    plugins = list_plugins()
-    return jsonify({"count": len(plugins), "plugins": plugins})
-
-@app.route("/plugins")
-def plugins_page():
-    plugins = list_plugins()
-    html = """
+    m = plugins_manifest()
+    resp = app.response_class(m["body"], mimetype="application/json")
+    resp.set_etag(m["etag"])  # ETag fort : hash du manifeste
+    resp.headers["Cache-Control"] = "no-cache"  # revalidation à chaque fois, 304 si inchangé
+    return resp.make_conditional(request)
+
+def _plugin_by_sha(sha: str):
+    for e in _plugin_entries.values():
+        if e["item"]["sha256"] == sha:
+            return e
+    return None
+
+@app.route("/plugins/by-sha/<sha>")
+def serve_plugin_by_sha(sha):
+    # adressage par contenu : la réponse ne change jamais pour un hash donné
+    sha = sha.lower()
+    plugins_manifest()
+    e = _plugin_by_sha(sha)
+    if e is None and PLUGINS_POLL_INTERVAL > 0:
+        refresh_plugins()  # fichier modifié depuis le dernier polling
+        e = _plugin_by_sha(sha)
+    if e is None:
+        abort(404)
+    resp = app.response_class(e["data"], mimetype="text/x-python")
+    resp.set_etag(sha)
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp.make_conditional(request)
+
+@app.route("/plugins/bundle")
+def plugins_bundle():
+    """
+    Every plugin a machine needs in one response.
+    ?machine_id=... (its plugins_required) or ?names=a,b ; ?have=sha,sha skips what the client already has.
+    Body: {"plugins": [{"name", "sha256", "source"}], "missing": [...]}, gzip if accepted.
+    """
+    names = [n.strip() for n in (request.args.get("names") or "").split(",") if n.strip()]
+    if not names:
+        mid = (request.args.get("machine_id") or "").strip()
+        with state_lock:
+            cfg = resolve_config(mid) if mid in machine_configs else CONFIG_DEFAULTS
+            names = list(cfg.get("plugins_required") or [])
+    have = set(h.strip().lower() for h in (request.args.get("have") or "").split(",") if h.strip())
+
+    plugins_manifest()
+    with _plugins_lock:
+        picked, missing = [], []
+        for n in names:
+            fname = n if n.endswith(".py") else f"{n}.py"
+            e = _plugin_entries.get(fname)
+            if e is None:
+                missing.append(n)
+            elif e["item"]["sha256"] not in have:
+                picked.append(e)
+
+    shas = tuple(e["item"]["sha256"] for e in picked)
+    etag = hashlib.sha256((",".join(shas) + "|" + ",".join(missing)).encode("utf-8")).hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    body = json.dumps({
+        "plugins": [{"name": e["item"]["name"], "sha256": e["item"]["sha256"],
+                     "source": e["data"].decode("utf-8")} for e in picked],
+        "missing": missing
+    }).encode("utf-8")
+    resp = app.response_class(mimetype="application/json")
+    if "gzip" in (request.headers.get("Accept-Encoding") or ""):
+        resp.set_data(gzip.compress(body, 6))
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp.set_data(body)
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.set_etag(etag)
+    return resp
+
+def _plugins_watcher_loop():
+    while True:
+        time.sleep(PLUGINS_POLL_INTERVAL)
+        try:
+            refresh_plugins()
+        except Exception:
+            pass
+
+PLUGINS_TEMPLATE = app.jinja_env.from_string("""
     <h1>GreenIdle - Plugins disponibles</h1>
     <p>Nombre: <b>{{ plugins|length }}</b></p>
 
@@ -103,8 +227,35 @@ def plugins_page():
     <p style="margin-top:16px;">
       JSON: <a href="/plugins.json" target="_blank">/plugins.json</a>
     </p>
-    """
-    return render_template_string(html, plugins=plugins)
+""")
+
+@app.route("/plugins")
+def plugins_page():
+    plugins = list_plugins()
+    return render_template(PLUGINS_TEMPLATE, plugins=plugins)
+
+# =========================
+#   STATIC (CSS/JS du dashboard)
+# =========================
+# Les templates sont compilés une fois à l'import (app.jinja_env.from_string) ;
+# CSS/JS vivent dans static/ et sont servis avec une URL versionnée par hash
+# du contenu (?v=...), donc cacheables sans limite côté navigateur.
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+_static_versions = {}
+
+def asset_url(filename: str) -> str:
+    v = _static_versions.get(filename)
+    if v is None:
+        v = _static_versions[filename] = file_sha256(os.path.join(STATIC_DIR, filename))[:12]
+    return url_for("static", filename=filename, v=v)
+
+app.jinja_env.globals["asset_url"] = asset_url
+
+@app.after_request
+def cache_static_assets(resp):
+    if request.endpoint == "static" and request.args.get("v") and resp.status_code == 200:
+        resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp
 
 # =========================
 #   CONFIG
@@ -113,42 +264,813 @@ APP_NAME = "GreenIdle"
 ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # Render env
 BLACKLIST_IPS = set(ip.strip() for ip in os.getenv("BLACKLIST_IPS", "").split(",") if ip.strip())
 DEBUG = False  # False sur Render
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"  # 0 = bancs de charge
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))  # plafond mémoire du limiteur
+# nombre de workers gunicorn entre lesquels la limite est partagée ; gunicorn
+# lit aussi WEB_CONCURRENCY comme valeur par défaut de -w
+RATE_LIMIT_WORKERS = max(1, int(os.getenv("RATE_LIMIT_WORKERS", os.getenv("WEB_CONCURRENCY", "1"))))
+
+# Leases : une tâche assignée expire si la machine disparaît
+LEASE_FACTOR = float(os.getenv("LEASE_FACTOR", "2"))                   # x task_max_seconds
+LEASE_GRACE_SECONDS = float(os.getenv("LEASE_GRACE_SECONDS", "30"))
+LEASE_REAPER_INTERVAL = float(os.getenv("LEASE_REAPER_INTERVAL", "0"))  # 0 = lazy (au dispatch)
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "3"))
+
+# Persistance : chemin SQLite (WAL) ; vide = tout en mémoire (comportement historique)
+GREENIDLE_DB = os.getenv("GREENIDLE_DB", "")
+# Multi-workers (gunicorn -w N) : la base SQLite devient l'état partagé
+GREENIDLE_SHARED = os.getenv("GREENIDLE_SHARED", "0") == "1"
+STORE_FLUSH_INTERVAL = float(os.getenv("STORE_FLUSH_INTERVAL", "1.0"))
+
+# Lots (/tasks/batch, /report/batch)
+BATCH_MAX_TASKS = int(os.getenv("BATCH_MAX_TASKS", "100"))
+BATCH_MAX_REPORTS = int(os.getenv("BATCH_MAX_REPORTS", "1000"))
+
+# Long-poll (/poll) : une requête attend au plus POLL_MAX_WAIT secondes qu'une
+# tâche arrive. Elle est réveillée par les événements (nouvelle tâche, bail
+# expiré, sync du store partagé, config) ; POLL_RECHECK_SECONDS n'est qu'un
+# filet de sécurité. Le watcher (un par worker, actif seulement s'il y a des
+# requêtes en attente) fait le sync et la récolte des baux toutes les
+# POLL_WATCH_INTERVAL secondes.
+POLL_MAX_WAIT = float(os.getenv("POLL_MAX_WAIT", "25"))
+POLL_RECHECK_SECONDS = float(os.getenv("POLL_RECHECK_SECONDS", "30"))
+POLL_WATCH_INTERVAL = float(os.getenv("POLL_WATCH_INTERVAL", "1"))
+# Workers sync : une requête tenue bloque tout le worker, donc /poll n'y attend
+# pas plus que POLL_SYNC_MAX_WAIT (0 = répond tout de suite, comme /task)
+POLL_SYNC_MAX_WAIT = float(os.getenv("POLL_SYNC_MAX_WAIT", "0"))
+
+# Journaux results / tasks_log : entrées gardées en mémoire, le reste part
+# dans des segments gzip JSONL (LOG_SPILL_DIR vide = plus anciennes oubliées)
+RESULTS_RETENTION = int(os.getenv("RESULTS_RETENTION", "10000"))
+TASKS_LOG_RETENTION = int(os.getenv("TASKS_LOG_RETENTION", "10000"))
+LOG_SPILL_DIR = os.getenv("LOG_SPILL_DIR", (GREENIDLE_DB + ".logs") if GREENIDLE_DB else os.path.join(BASE_DIR, "greenidle_logs"))
+
+# Pages admin (/results, /jobs, /jobs/<id> et variantes .json)
+PAGE_SIZE = 100
+PAGE_SIZE_MAX = 1000
+
+# Plugins multi-processus : plafond de "plugin_workers" par machine
+PLUGIN_WORKERS_MAX = 256
+
+# =========================
+#   MODE ASYNC (gevent)
+# =========================
+# Déploiement conseillé (Procfile.txt), surtout pour les grosses flottes :
+#   gunicorn -k gevent --worker-connections 10000 greenidle_server:app
+# Le worker gevent patche threading/socket/time avant d'importer l'app : les
+# verrous, les Events de /poll et les threads de fond deviennent coopératifs.
+# Aucune section critique (state_lock, _work_lock) ne fait d'I/O réseau ni de
+# sleep, et les requêtes SQLite passent par le pool de threads de gevent
+# (cf. greenidle_store), donc le hub n'est pas bloqué par la base, y compris
+# en mode partagé (BEGIN IMMEDIATE).
+# Avec --preload, l'app est importée avant le patch : ses verrous sont natifs
+# et un greenlet qui attend bloquerait tout le worker. Le mode est donc décidé
+# à l'exécution : long-poll seulement si le patch précédait l'import.
+_PATCHED_AT_IMPORT = greenidle_store.gevent_patched()
+_preload_warned = False
+
+def async_workers() -> bool:
+    """True in a gevent worker whose monkey patch ran before this module was imported."""
+    global _preload_warned
+    if _PATCHED_AT_IMPORT:
+        return True
+    if not _preload_warned and greenidle_store.gevent_patched():
+        _preload_warned = True
+        app.logger.warning("gevent patché après l'import (--preload ?) : long-poll désactivé, "
+                           "lancez gunicorn -k gevent sans --preload")
+    return False
 
 # =========================
 #   MINI BDD EN MEMOIRE
 # =========================
 machines = {}         # machine_id -> dict
-machine_configs = {}  # machine_id -> config dict
+machine_configs = {}  # machine_id -> {"profile", "overrides", "version"} (cf. PROFILS DE CONFIG)
 jobs = {}             # job_id -> dict
 tasks = {}            # task_id -> dict
-results = []          # list[dict]
-tasks_log = []        # list[dict]
+results = greenidle_logs.LogRing("results", RESULTS_RETENTION, LOG_SPILL_DIR,      # anneau borné + segments
+                                 index_fields=("job_id", "machine_id"))          # filtres de /results
+tasks_log = greenidle_logs.LogRing("tasks_log", TASKS_LOG_RETENTION, LOG_SPILL_DIR)  # idem, sans payload
 
 # Auth clients minimal
 clients = {}            # client_id -> {"machine_key": "...", "created_at": "..."}
 machine_to_client = {}  # machine_id -> client_id
 
+state_lock = threading.RLock()  # dispatch + transitions atomiques (threads)
+
+# Les dicts ci-dessus restent la copie de travail ; le store persiste en
+# différé chaque objet signalé par store.put() / store.append().
+# les tables SQLite results / tasks_log gardent la rétention des anneaux (+ un
+# lot de spill en marge) : le reste est dans les segments, ou oublié
+store = greenidle_store.open_store(
+    GREENIDLE_DB, lock=state_lock, flush_interval=STORE_FLUSH_INTERVAL, shared=GREENIDLE_SHARED,
+    log_retention={"results": RESULTS_RETENTION + greenidle_logs.SPILL_BATCH,
+                   "tasks_log": TASKS_LOG_RETENTION + greenidle_logs.SPILL_BATCH},
+)
+
+@contextmanager
+def state_txn():
+    """
+    Wraps every read-modify-write of the shared state. In-process it is just
+    state_lock; with a shared store it is also a cross-worker transaction that
+    first merges what the other workers wrote (apply_store_changes).
+    """
+    with state_lock:
+        if store.shared:
+            with store.transaction(apply_store_changes):
+                yield
+        else:
+            yield
+
+def known_config(machine_id: str):
+    """
+    Resolved config of an already registered machine, read from the cache
+    (synced before the request), or None. Lets read-mostly routes answer
+    under state_lock alone instead of taking the shared write lock.
+    """
+    if machine_id in machines and machine_id in machine_configs:
+        return resolve_config(machine_id)
+    return None
+
+def with_state_txn(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        with state_txn():
+            return f(*args, **kwargs)
+    return wrapper
+
+# =========================
+#   VERSIONS MACHINES (deltas du dashboard)
+# =========================
+# Tout changement d'une machine ou de sa config lui donne une nouvelle
+# version : un horodatage ns strictement croissant, comparable entre workers
+# (le sync du store partagé a lieu avant chaque requête). /api/dashboard?since=v
+# ne renvoie que les machines de version > v ; machine_versions est tenu dans
+# l'ordre des versions, donc le delta coûte O(changements).
+# Les KPIs sont mis à jour au même moment au lieu d'être recalculés par page.
+machine_versions = OrderedDict()  # machine_id -> version (ordre croissant)
+dash_kpis = {"machines": 0, "total_seconds": 0}
+_kpi_seconds = {}  # machine_id -> total_seconds déjà compté dans dash_kpis
+_dash_last = 0
+
+def version_clock() -> int:
+    global _dash_last
+    _dash_last = max(_dash_last + 1, time.time_ns())
+    return _dash_last
+
+def touch_machine(machine_id: str):
+    m = machines.get(machine_id)
+    if m is None:
+        return
+    if machine_id not in _kpi_seconds:
+        dash_kpis["machines"] += 1
+    secs = m.get("total_seconds") or 0
+    dash_kpis["total_seconds"] += secs - _kpi_seconds.get(machine_id, 0)
+    _kpi_seconds[machine_id] = secs
+    machine_versions[machine_id] = version_clock()
+    machine_versions.move_to_end(machine_id)
+
+def save_machine(machine_id: str):
+    store.put("machines", machine_id, machines[machine_id])
+    touch_machine(machine_id)
+
+def save_machine_config(machine_id: str, notify: bool = True):
+    # toute écriture de config est un changement : version monotone (cf. resolve_config)
+    rec = machine_configs[machine_id]
+    rec["version"] = version_clock()
+    store.put("machine_configs", machine_id, rec)
+    touch_machine(machine_id)
+    if notify:
+        signal_machines((machine_id,))  # son /poll en attente relit sa config
+
+# =========================
+#   ATTENTE DE TRAVAIL (long-poll)
+# =========================
+# Les /poll sans tâche dorment au lieu de revenir en 204. Chaque requête en
+# attente a son Event, inscrit sous les task_types que sa machine sait
+# exécuter : une nouvelle tâche ne réveille qu'un waiter capable de la prendre
+# (pas de troupeau, pas de réveil perdu chez une machine sans le plugin).
+# L'inscription se fait sous state_lock, dans la même transaction que le
+# constat "rien pour moi" : un enqueue ne peut pas se glisser entre les deux.
+# Le waiter garde aussi les ressources de sa machine : un job avec "requires"
+# ne réveille que des machines qui passent job_fits().
+# Un changement de config ne réveille que les machines concernées (index par
+# machine_id) : la machine modifiée, ou les membres du profil modifié.
+# Sous gevent (monkey patch), Event et Lock sont coopératifs.
+_work_lock = threading.Lock()
+_waiters = {}             # Event -> (task_types attendus, caps, machine_id)
+_waiters_by_type = {}     # task_type -> {Event: None} (ordre d'arrivée)
+_waiters_by_machine = {}  # machine_id -> {Event: None}
+
+def register_waiter(task_types, caps: dict = None, machine_id: str = None) -> threading.Event:
+    _ensure_poll_watcher()
+    ev = threading.Event()
+    with _work_lock:
+        _waiters[ev] = (tuple(task_types), caps or {}, machine_id)
+        for tt in _waiters[ev][0]:
+            _waiters_by_type.setdefault(tt, {})[ev] = None
+        _waiters_by_machine.setdefault(machine_id, {})[ev] = None
+    return ev
+
+def _drop_index(index: dict, key, ev):
+    q = index.get(key)
+    if q is not None:
+        q.pop(ev, None)
+        if not q:
+            del index[key]
+
+def unregister_waiter(ev: threading.Event):
+    with _work_lock:
+        task_types, _caps, machine_id = _waiters.pop(ev, ((), None, None))
+        for tt in task_types:
+            _drop_index(_waiters_by_type, tt, ev)
+        _drop_index(_waiters_by_machine, machine_id, ev)
+
+def signal_machines(machine_ids):
+    """Wakes the waiters of these machines (their config changed)."""
+    with _work_lock:
+        targets = [ev for mid in machine_ids for ev in _waiters_by_machine.get(mid, ())]
+    for ev in targets:
+        ev.set()
+
+def signal_work(task_type: str = None, n: int = 1, job: dict = None):
+    """
+    Wakes up to n waiters able to run task_type (n=None: all of them). With a
+    job, waiters whose machine does not fit its requirements are skipped.
+    """
+    with _work_lock:
+        targets = []
+        for ev in _waiters_by_type.get(task_type, ()):
+            if ev.is_set():  # déjà réveillé, pas encore désinscrit
+                continue
+            if job is not None and not job_fits(job, _waiters[ev][1]):
+                continue
+            targets.append(ev)
+            if n is not None and len(targets) >= n:
+                break
+    for ev in targets:
+        ev.set()
+
+_poll_watcher_pid = None
+
+def _ensure_poll_watcher():
+    # démarré au premier waiter, dans le worker lui-même (après fork / monkey patch)
+    global _poll_watcher_pid
+    if _poll_watcher_pid != os.getpid():
+        _poll_watcher_pid = os.getpid()
+        threading.Thread(target=_poll_watcher_loop, name="poll-watcher", daemon=True).start()
+
+def _poll_watcher_loop():
+    """
+    One store sync + lease check per worker per interval while polls are held,
+    instead of one transaction per held request. Both paths end in
+    enqueue_task() / apply_store_changes(), which wake the right waiters.
+    """
+    while True:
+        time.sleep(POLL_WATCH_INTERVAL)
+        if not _waiters:
+            continue
+        try:
+            if store.shared:
+                sync_state()
+            if lease_heap and lease_heap[0][0] <= time.time():
+                with state_txn():
+                    reap_expired_leases()
+        except Exception:
+            pass
+
+# =========================
+#   DISPATCH (files pending O(1))
+# =========================
+# Chaque job a sa FIFO de task_id pending ; les jobs qui ont du travail
+# tournent dans un anneau (round-robin) par task_type, donc /task ne scanne
+# plus `tasks` et une machine ne regarde que les types qu'elle sait exécuter.
+pending_queues = {}   # job_id -> deque[task_id]
+ready_by_type = {}    # task_type -> anneau des job_id ayant (peut-être) du pending
+_ready_set = set()    # job_id présents dans un anneau, test d'appartenance O(1)
+MATCH_SCAN_MAX = 8    # jobs incompatibles (ressources) sautés au plus par type et par poll
+_type_turn = 0        # rotation du type servi en premier (équité entre types)
+
+# Index job -> tâches + compteurs par statut (tenus à jour à chaque transition)
+job_task_ids = {}  # job_id -> list[task_id] (ordre de création)
+task_pos = {}      # task_id -> rang dans job_task_ids[job_id] (curseur de /jobs/<id>)
+job_status_pos = {}   # job_id -> {status: [rangs triés]} (filtre status de /jobs/<id>, bisect)
+TASK_STATUSES = ("pending", "assigned", "done", "failed")
+
+# Index des jobs pour /jobs : clés "created_at|job_id" triées, toutes et par
+# status / type ; une page se lit par bisect depuis le curseur ?before=.
+job_keys = []      # toutes les clés, triées
+job_keys_by = {}   # ("status"|"type", valeur) -> clés triées
+_job_indexed = {}  # job_id -> (clé, status, task_type) tels qu'indexés
+
+def _sorted_remove(lst: list, x):
+    i = bisect.bisect_left(lst, x)
+    if i < len(lst) and lst[i] == x:
+        del lst[i]
+
+def job_key(job: dict) -> str:
+    return f"{job.get('created_at') or ''}|{job['job_id']}"
+
+def index_job(job: dict):
+    """(Re)places a job in the /jobs indexes; call after a creation, a reload or a status change."""
+    cur = (job_key(job), job.get("status"), job.get("task_type"))
+    old = _job_indexed.get(job["job_id"])
+    if old == cur:
+        return
+    if old is None:
+        bisect.insort(job_keys, cur[0])
+    else:
+        if old[0] != cur[0]:
+            _sorted_remove(job_keys, old[0])
+            bisect.insort(job_keys, cur[0])
+        _sorted_remove(job_keys_by.get(("status", old[1]), []), old[0])
+        _sorted_remove(job_keys_by.get(("type", old[2]), []), old[0])
+    bisect.insort(job_keys_by.setdefault(("status", cur[1]), []), cur[0])
+    bisect.insort(job_keys_by.setdefault(("type", cur[2]), []), cur[0])
+    _job_indexed[job["job_id"]] = cur
+
+def index_task(t: dict):
+    ids = job_task_ids.setdefault(t["job_id"], [])
+    pos = task_pos[t["task_id"]] = len(ids)
+    ids.append(t["task_id"])
+    bisect.insort(job_status_pos.setdefault(t["job_id"], {}).setdefault(t["status"], []), pos)
+
+def reindex_task_status(t: dict, old: str):
+    by_status = job_status_pos.setdefault(t["job_id"], {})
+    pos = task_pos[t["task_id"]]
+    _sorted_remove(by_status.get(old, []), pos)
+    bisect.insort(by_status.setdefault(t["status"], []), pos)
+
+def job_counts(job: dict) -> dict:
+    counts = job.get("counts")
+    if counts is None:
+        counts = job["counts"] = {st: 0 for st in TASK_STATUSES}
+    return counts
+
+def set_task_status(t: dict, status: str):
+    """
+    Moves a task to `status`, keeping its job counters in sync.
+    The job is marked done as soon as nothing is pending or assigned anymore.
+    """
+    old = t["status"]
+    t["status"] = status
+    t["updated_at"] = now_iso()
+    store.put("tasks", t["task_id"], t)
+    if old == status:
+        return
+    reindex_task_status(t, old)
+
+    job = jobs.get(t["job_id"])
+    if not job:
+        return
+    store.put("jobs", job["job_id"], job)
+    counts = job_counts(job)
+    counts[old] = max(0, counts.get(old, 0) - 1)
+    counts[status] = counts.get(status, 0) + 1
+
+    if status == "assigned" and job["status"] == "pending":
+        job["status"] = "running"
+    if counts["pending"] == 0 and counts["assigned"] == 0:
+        job["status"] = "done" if counts["failed"] == 0 else "failed"
+    elif job["status"] in ("done", "failed"):
+        job["status"] = "running"
+    index_job(job)
+
+def enqueue_task(task_id: str, job_id: str, front: bool = False):
+    """Puts a pending task in its job FIFO (front=True for a re-queue)."""
+    q = pending_queues.get(job_id)
+    if q is None:
+        q = pending_queues[job_id] = deque()
+    if front:
+        q.appendleft(task_id)
+    else:
+        q.append(task_id)
+    mark_job_ready(job_id)
+    job = jobs.get(job_id)
+    signal_work(job.get("task_type") if job else None, job=job)
+
+def _job_type(job_id: str):
+    job = jobs.get(job_id)
+    return job.get("task_type") if job else None
+
+def mark_job_ready(job_id: str):
+    if job_id not in _ready_set:
+        _ready_set.add(job_id)
+        task_type = _job_type(job_id)
+        ready_by_type.setdefault(task_type, deque()).append(job_id)
+        # grille paresseuse : ses tâches n'existent pas encore, toutes les machines du type peuvent en prendre
+        job = jobs.get(job_id)
+        if job and grid_remaining(job):
+            signal_work(task_type, n=None, job=job)
+
+def _drop_ready_job(ring: deque, task_type: str):
+    # le job est toujours en tête de son anneau quand on l'appelle
+    job_id = ring.popleft()
+    _ready_set.discard(job_id)
+    pending_queues.pop(job_id, None)
+    if not ring:
+        del ready_by_type[task_type]
+
+def job_fits(job: dict, caps: dict) -> bool:
+    """Job resource requirements (min_cores / min_ram_mb) vs what the machine advertised."""
+    req = job.get("requires")
+    if not req or not caps:
+        return True  # rien d'exigé, ou client qui n'annonce rien (ancien client)
+    for key in ("cores", "ram_mb"):
+        if req.get(key) and caps.get(key) and caps[key] < req[key]:
+            return False
+    return True
+
+def pop_pending_task(task_types, caps: dict = None):
+    """
+    Returns the next pending task among `task_types` (tried in order, see
+    machine_task_types) whose job fits `caps`, or None. Jobs of a type are
+    served round-robin; entries whose task is no longer pending (ex: reported
+    without being assigned) are skipped lazily, and at most MATCH_SCAN_MAX
+    unfit jobs are passed over per type, so each call is amortized O(1).
+    Re-queued tasks go first; then lazy jobs (grids) materialize their next task.
+    """
+    for task_type in task_types:
+        ring = ready_by_type.get(task_type)
+        skipped = 0
+        while ring and skipped < min(len(ring), MATCH_SCAN_MAX):
+            job_id = ring[0]
+            job = jobs.get(job_id)
+            if job and not job_fits(job, caps):
+                ring.rotate(-1)
+                skipped += 1
+                continue
+            q = pending_queues.get(job_id)
+            t = None
+            while q and t is None:
+                t = tasks.get(q.popleft())
+                if t is not None and t["status"] != "pending":
+                    t = None
+            if t is None and job:
+                t = next_grid_task(job)
+            if t is None:
+                _drop_ready_job(ring, task_type)
+                ring = ready_by_type.get(task_type)
+                continue
+            if q or (job and grid_remaining(job)):
+                ring.rotate(-1)
+            else:
+                _drop_ready_job(ring, task_type)
+            return t
+    return None
+
+def plugin_sha(task_type: str):
+    e = _plugin_entries.get(f"{task_type}.py")
+    return e["item"]["sha256"] if e else None
+
+def machine_task_types(machine_id: str, cfg: dict) -> list:
+    """
+    Task types this machine may run (its plugins_required) that have pending
+    work, warm plugins first: those whose current sha256 (or name) the machine
+    advertised as cached. Each group starts at a rotating offset for fairness.
+    """
+    global _type_turn
+    have = (machines.get(machine_id, {}).get("caps") or {}).get("plugins") or ()
+    warm, cold = [], []
+    for name in cfg.get("plugins_required") or ():
+        if name not in ready_by_type:
+            continue
+        (warm if name in have or plugin_sha(name) in have else cold).append(name)
+    _type_turn += 1
+    return [g[(i + _type_turn) % len(g)] for g in (warm, cold) for i in range(len(g))]
+
+def may_dispatch(cfg: dict) -> bool:
+    """
+    Cheap pre-check: could a dispatch hand a task to a machine with this
+    config (a ready job of one of its types, or a lease to reap)? False is exact.
+    """
+    if lease_heap and lease_heap[0][0] <= time.time():
+        return True
+    return any(name in ready_by_type for name in cfg.get("plugins_required") or ())
+
+def machine_caps(machine_id: str) -> dict:
+    return machines.get(machine_id, {}).get("caps") or {}
+
+def capable_machines(task_type: str, job: dict = None) -> int:
+    """Known, enabled machines whose plugins_required include task_type (and that fit job, if given)."""
+    n = 0
+    for mid in machines:
+        if mid not in machine_configs:
+            continue
+        cfg = resolve_config(mid)
+        if not cfg.get("enabled", True) or task_type not in (cfg.get("plugins_required") or ()):
+            continue
+        if job is None or job_fits(job, machine_caps(mid)):
+            n += 1
+    return n
+
+def update_capabilities(m: dict, data: dict):
+    """Stores what a heartbeat advertises: cores, ram_mb, cached plugins (sha256 list or {name: sha256})."""
+    caps = dict(m.get("caps") or {})
+    for key in ("cores", "ram_mb"):
+        if key in data:
+            caps[key] = safe_int(data.get(key), default=0, min_value=0)
+    if "plugins" in data:
+        plugins = data.get("plugins")
+        if isinstance(plugins, dict):
+            have = list(plugins) + list(plugins.values())
+        elif isinstance(plugins, str):
+            have = [plugins]  # un seul plugin, pas une liste de caractères
+        elif isinstance(plugins, list):
+            have = plugins
+        else:
+            have = []
+        have = [h for h in have if isinstance(h, str)]  # null / nombres ignorés
+        caps["plugins"] = sorted(set(h.strip().lower().removesuffix(".py") for h in have if h.strip()))
+    if caps:
+        m["caps"] = caps
+
+# =========================
+#   LEASES (expiration + re-queue)
+# =========================
+# Une tâche assignée porte un bail (lease_expires, epoch secondes) dérivé du
+# task_max_seconds de la machine ; chaque heartbeat le prolonge. Les baux
+# expirés repartent en tête de leur file pending jusqu'à TASK_MAX_ATTEMPTS,
+# puis la tâche passe en "failed". Le tas contient des entrées périmées
+# (bail prolongé ou libéré) qui sont simplement ignorées au dépilage.
+lease_heap = []      # heap[(deadline, task_id)]
+machine_leases = {}  # machine_id -> set(task_id)
+
+def lease_seconds(cfg: dict) -> float:
+    return float(cfg.get("task_max_seconds", 30)) * LEASE_FACTOR + LEASE_GRACE_SECONDS
+
+def grant_lease(t: dict, machine_id: str, cfg: dict, extra_seconds: float = 0.0):
+    deadline = time.time() + lease_seconds(cfg) + extra_seconds
+    t["assigned_to"] = machine_id
+    t["attempts"] = t.get("attempts", 0) + 1
+    t["lease_expires"] = deadline
+    track_lease(t)
+    set_task_status(t, "assigned")
+
+def track_lease(t: dict):
+    heapq.heappush(lease_heap, (t["lease_expires"], t["task_id"]))
+    machine_leases.setdefault(t.get("assigned_to"), set()).add(t["task_id"])
+
+def release_lease(t: dict):
+    untrack_lease(t)
+    t["lease_expires"] = None
+
+def untrack_lease(t: dict):
+    held = machine_leases.get(t.get("assigned_to"))
+    if held is not None:
+        held.discard(t["task_id"])
+        if not held:
+            machine_leases.pop(t.get("assigned_to"), None)
+
+def extend_leases(machine_id: str, cfg: dict):
+    """Heartbeat: pushes back the deadline of every task held by machine_id."""
+    held = machine_leases.get(machine_id)
+    if not held:
+        return
+    deadline = time.time() + lease_seconds(cfg)
+    for task_id in held:
+        t = tasks.get(task_id)
+        if t and t["status"] == "assigned":
+            t["lease_expires"] = deadline
+            heapq.heappush(lease_heap, (deadline, task_id))
+            store.put("tasks", task_id, t)
+
+def reap_expired_leases(now: float = None) -> int:
+    """Re-queues (or fails) every task whose lease has expired. Returns the count."""
+    now = time.time() if now is None else now
+    reaped = 0
+    while lease_heap and lease_heap[0][0] <= now:
+        deadline, task_id = heapq.heappop(lease_heap)
+        t = tasks.get(task_id)
+        if t is None or t["status"] != "assigned" or t.get("lease_expires") != deadline:
+            continue  # entrée périmée
+        release_lease(t)
+        t["assigned_to"] = None
+        if t.get("attempts", 0) >= TASK_MAX_ATTEMPTS:
+            set_task_status(t, "failed")
+        else:
+            set_task_status(t, "pending")
+            enqueue_task(task_id, t["job_id"], front=True)
+        reaped += 1
+    return reaped
+
+def _lease_reaper_loop():
+    while True:
+        time.sleep(LEASE_REAPER_INTERVAL)
+        try:
+            with state_txn():
+                reap_expired_leases()
+        except Exception:
+            pass
+
+_worker_pid = None
+
+@app.before_request
+def start_worker():
+    """
+    Once per process, in the worker itself (a thread started at import does
+    not survive the fork with --preload): numbers the worker for its log seqs
+    and starts the lease reaper and the plugins watcher.
+    """
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    with state_lock:
+        if _worker_pid == os.getpid():
+            return
+        results.seq_tag = tasks_log.seq_tag = store.worker_id()
+        if LEASE_REAPER_INTERVAL > 0:
+            threading.Thread(target=_lease_reaper_loop, name="lease-reaper", daemon=True).start()
+        if PLUGINS_POLL_INTERVAL > 0:
+            threading.Thread(target=_plugins_watcher_loop, name="plugins-watcher", daemon=True).start()
+        _worker_pid = os.getpid()
+
+# =========================
+#   COÛT ESTIMÉ DES TÂCHES (dimensionne /tasks/batch)
+# =========================
+# Moyenne mobile (EWMA) des secondes observées par type de tâche, rapportée
+# à l'unité de "size" quand la tâche en a une (ex: n de montecarlo).
+task_costs = {}  # task_type -> secondes par unité
+TASK_COST_DEFAULT = 1.0
+TASK_COST_ALPHA = 0.2
+
+def _cost_units(t: dict) -> int:
+    return max(1, int(t.get("size") or 0))
+
+def estimate_task_seconds(t: dict) -> float:
+    unit = task_costs.get(t.get("task_type"))
+    if unit is None:
+        return TASK_COST_DEFAULT
+    return unit * _cost_units(t)
+
+def observe_task_cost(t: dict, seconds: float):
+    if seconds is None or seconds < 0:
+        return
+    sample = float(seconds) / _cost_units(t)
+    old = task_costs.get(t.get("task_type"))
+    task_costs[t.get("task_type")] = sample if old is None else (1 - TASK_COST_ALPHA) * old + TASK_COST_ALPHA * sample
+
+# =========================
+#   REPRISE AU DÉMARRAGE + SYNC ENTRE WORKERS (store persistant)
+# =========================
+def load_state():
+    """
+    Reloads the persisted tables into the in-memory dicts and rebuilds the
+    derived indexes (job -> tasks, counters, pending queues, leases).
+    """
+    data = store.load(log_limit=max(RESULTS_RETENTION, TASKS_LOG_RETENTION))
+    if not data:
+        return
+
+    with state_lock:
+        machines.update(data.get("machines", {}))
+        config_profiles.update(data.get("config_profiles", {}))
+        for machine_id, rec in data.get("machine_configs", {}).items():
+            set_config_record(machine_id, rec)
+        jobs.update(data.get("jobs", {}))
+        tasks.update(data.get("tasks", {}))
+        clients.update(data.get("clients", {}))
+        machine_to_client.update(data.get("machine_to_client", {}))
+        # partagé : chaque worker recharge les mêmes lignes, seul leur auteur les déverse
+        results.extend(data.get("results", []), spill=not store.shared)
+        tasks_log.extend(data.get("tasks_log", []), spill=not store.shared)
+
+        for machine_id in machines:
+            touch_machine(machine_id)
+
+        for job in jobs.values():
+            index_job(job)
+            job["counts"] = {st: 0 for st in TASK_STATUSES}
+            # tâches de grille pas encore matérialisées
+            job["counts"]["pending"] = grid_remaining(job)
+            if grid_remaining(job):
+                mark_job_ready(job["job_id"])
+
+        for t in tasks.values():
+            index_task(t)
+            job = jobs.get(t["job_id"])
+            if job:
+                job["counts"][t["status"]] = job["counts"].get(t["status"], 0) + 1
+            if t["status"] == "pending":
+                enqueue_task(t["task_id"], t["job_id"])
+            elif t["status"] == "assigned":
+                t["lease_expires"] = t.get("lease_expires") or time.time()
+                track_lease(t)
+
+def apply_store_changes(ch: dict):
+    """
+    Merges rows written by other workers (shared store) into the local dicts.
+    Job rows are authoritative for counters and aggregates; task rows only
+    refresh the local pending queues and lease index.
+    """
+    machines.update(ch.get("machines", {}))
+    for machine_id, rec in ch.get("machine_configs", {}).items():
+        set_config_record(machine_id, rec)
+    for machine_id in set(ch.get("machines", {})) | set(ch.get("machine_configs", {})):
+        touch_machine(machine_id)
+    config_profiles.update(ch.get("config_profiles", {}))
+    # seuls les /poll des machines touchées relisent leur config
+    signal_machines(ch.get("machine_configs", {}))
+    for name in ch.get("config_profiles", {}):
+        signal_machines(profile_members.get(name, ()))
+    clients.update(ch.get("clients", {}))
+    machine_to_client.update(ch.get("machine_to_client", {}))
+    jobs.update(ch.get("jobs", {}))
+    for job_id, job in ch.get("jobs", {}).items():
+        index_job(job)
+        if grid_remaining(job):
+            mark_job_ready(job_id)
+
+    for task_id, t in ch.get("tasks", {}).items():
+        old = tasks.get(task_id)
+        tasks[task_id] = t
+        if old is None:
+            index_task(t)
+        else:
+            if old["status"] != t["status"]:
+                reindex_task_status(t, old["status"])
+            if old["status"] == "assigned":
+                untrack_lease(old)
+        if t["status"] == "pending" and (old is None or old["status"] != "pending"):
+            enqueue_task(task_id, t["job_id"], front=old is not None)
+        elif t["status"] == "assigned" and t.get("lease_expires"):
+            track_lease(t)
+
+    results.extend(ch.get("results", []))
+    tasks_log.extend(ch.get("tasks_log", []))
+
+@app.before_request
+def sync_state():
+    # store partagé : rafraîchit le cache local avant toute lecture
+    if store.shared:
+        with state_lock:
+            ch = store.changes()
+            if ch:
+                apply_store_changes(ch)
+
+
 # =========================
 #   UTILS
 # =========================
 def now_iso():
     return datetime.utcnow().isoformat()
 
+def arg_limit() -> int:
+    return safe_int(request.args.get("limit"), default=PAGE_SIZE, min_value=1, max_value=PAGE_SIZE_MAX)
+
+def arg_time_ns(name: str):
+    """?since= / ?until= : epoch seconds or ISO 8601 (UTC when naive, like now_iso())."""
+    raw = (request.args.get(name) or "").strip()
+    if not raw:
+        return None
+    try:
+        return int(float(raw) * 1e9)
+    except ValueError:
+        pass
+    try:
+        dt = datetime.fromisoformat(raw)
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1e9)
+
 def get_ip():
     fwd = request.headers.get("X-Forwarded-For", "")
     if fwd:
         return fwd.split(",")[0].strip()
     return request.remote_addr or "unknown"
 
-_RATE = {}  # {key: [timestamps]}
+# Limiteur GCRA : `limit` requêtes en rafale puis une toutes les window/limit s.
+# État O(1) par clé : la date théorique d'arrivée (tat). Une clé dont le tat
+# est passé est au repos et peut être oubliée sans perte ; au-delà de
+# RATE_LIMIT_MAX_KEYS, les clés les moins récemment vues sont évincées.
+# L'état reste local au worker, même en store partagé (aucune écriture SQLite
+# par requête) : chaque worker applique limit / RATE_LIMIT_WORKERS, les
+# connexions étant réparties entre workers par le noyau.
+_RATE = OrderedDict()  # {key: tat}, ordre LRU
+_rate_lock = threading.Lock()
+
+def _gcra_acquire(key: str, interval: float, window: float, now: float) -> bool:
+    with _rate_lock:
+        old = _RATE.pop(key, None)
+        tat = max(old or now, now) + interval
+        if tat - now > window:
+            _RATE[key] = old
+            return False
+        _RATE[key] = tat
+        while _RATE:
+            k, t = next(iter(_RATE.items()))
+            if t > now and len(_RATE) <= RATE_LIMIT_MAX_KEYS:
+                break
+            del _RATE[k]
+        return True
+
 def rate_limit(key: str, limit=30, window=60):
-    now = time.time()
-    lst = _RATE.get(key, [])
-    lst = [t for t in lst if now - t < window]
-    if len(lst) >= limit:
+    if not RATE_LIMIT_ENABLED:
+        return
+    limit = max(1.0, limit / float(RATE_LIMIT_WORKERS))
+    if not _gcra_acquire(key, window / limit, window, time.time()):
         abort(429)
-    lst.append(now)
-    _RATE[key] = lst
 
 def is_blacklisted():
     return get_ip() in BLACKLIST_IPS
@@ -199,8 +1121,9 @@ def verify_client_if_present(machine_id: str = None):
 
     rate_limit(f"client:{client_id}", limit=240, window=60)
 
-    if machine_id:
+    if machine_id and machine_to_client.get(machine_id) != client_id:
         machine_to_client[machine_id] = client_id
+        store.put("machine_to_client", machine_id, client_id)
 
     return {"mode": "signed", "client_id": client_id}
 
@@ -217,9 +1140,11 @@ def ensure_machine(machine_id, display_name=None):
             "total_seconds": 0,
             "last_cpu": 0.0,
         }
+        save_machine(machine_id)
     else:
         if display_name:
             machines[machine_id]["display_name"] = display_name
+            save_machine(machine_id)
 
     return machines[machine_id]
 
@@ -232,7 +1157,15 @@ def default_config():
         "task_max_seconds": 30,
         "post_task_sleep_seconds": 2,
 
+        # processus par tâche pour les plugins parallélisables (montecarlo, optimizer_grid)
+        "plugin_workers": 1,
+
         # ✅ plugins requis (auto-download côté client)
+        # C'est aussi la liste des task_types que la machine reçoit : avec la
+        # valeur par défaut, seuls les jobs montecarlo sont distribués.
+        # Migration d'une flotte existante : ajouter les autres types au profil
+        #   POST /profiles/default {"plugins_required": ["montecarlo", "optimizer_grid", "hello"]}
+        # /submit affiche le nombre de machines capables de prendre chaque type.
         "plugins_required": ["montecarlo"],
 
         "night_mode": {
@@ -244,17 +1177,201 @@ def default_config():
     }
 
 def ensure_config(machine_id: str):
-    cfg = machine_configs.get(machine_id)
-    if not cfg:
-        cfg = default_config()
-        machine_configs[machine_id] = cfg
+    """Resolved config of a machine (read-only: changes go through update_machine_config)."""
+    if machine_id not in machine_configs:
+        set_config_record(machine_id, {"profile": DEFAULT_PROFILE, "overrides": {}})
+        save_machine_config(machine_id, notify=False)  # création : personne n'attend cette config
+    return resolve_config(machine_id)
 
-    # sécurité : s'assurer que la clé existe toujours
-    if "plugins_required" not in cfg or not isinstance(cfg.get("plugins_required"), list):
+# =========================
+#   PROFILS DE CONFIG (héritage + overrides)
+# =========================
+# Une machine ne stocke plus une copie de default_config() mais
+# {"profile": nom, "overrides": {...}, "version"} : seules les clés qui
+# diffèrent de son profil. Un profil est lui-même un diff de default_config().
+# La config résolue (défauts <- profil <- overrides) est mise en cache par
+# (version machine, profil, version profil) : modifier un profil coûte O(1),
+# ses machines sont re-résolues à leur prochain accès, et /api/dashboard
+# ajoute ses membres quand la version du profil dépasse ?since= (cf.
+# profile_changed_members). Les versions viennent de version_clock(), donc
+# max(machine, profil) croît à chaque changement.
+DEFAULT_PROFILE = "default"
+CONFIG_DEFAULTS = default_config()
+config_profiles = {}    # nom -> {"name", "settings", "version"}
+profile_members = {}    # nom -> set(machine_id)
+_resolved_configs = {}  # machine_id -> (clé de version, config résolue)
+
+def profile_version(name: str) -> int:
+    p = config_profiles.get(name)
+    return p["version"] if p else 0
+
+def profile_base(name: str) -> dict:
+    base = dict(CONFIG_DEFAULTS)
+    p = config_profiles.get(name)
+    if p:
+        base.update(p["settings"])
+    return base
+
+def sparse_diff(values: dict, base: dict) -> dict:
+    return {k: v for k, v in values.items() if k in CONFIG_DEFAULTS and base.get(k) != v}
+
+def set_config_record(machine_id: str, rec: dict):
+    """Installs a machine config record (local or synced), keeping profile_members in sync."""
+    if "overrides" not in rec:
+        # ancienne ligne : copie complète de default_config()
+        rec = {"profile": DEFAULT_PROFILE, "overrides": sparse_diff(rec, CONFIG_DEFAULTS),
+               "version": rec.get("version", 0)}
+    old = machine_configs.get(machine_id)
+    if old is not None:
+        profile_members.get(old["profile"], set()).discard(machine_id)
+    machine_configs[machine_id] = rec
+    profile_members.setdefault(rec["profile"], set()).add(machine_id)
+
+def resolve_config(machine_id: str) -> dict:
+    rec = machine_configs[machine_id]
+    name = rec["profile"]
+    key = (rec.get("version", 0), name, profile_version(name))
+    cached = _resolved_configs.get(machine_id)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    cfg = profile_base(name)
+    cfg.update(rec["overrides"])
+    if not isinstance(cfg.get("plugins_required"), list):
         cfg["plugins_required"] = ["montecarlo"]
-
+    cfg["profile"] = name
+    cfg["version"] = max(key[0], key[2])
+    _resolved_configs[machine_id] = (key, cfg)
     return cfg
 
+def resolved_configs(machine_ids) -> dict:
+    """machine_id -> resolved config, for the dashboard templates."""
+    return {mid: resolve_config(mid) for mid in machine_ids if mid in machine_configs}
+
+_TRUE_STRINGS = ("1", "true", "yes", "on", "oui")
+_FALSE_STRINGS = ("0", "false", "no", "off", "non", "")
+_CONFIG_RANGES = {"plugin_workers": (1, PLUGIN_WORKERS_MAX), "start_hour": (0, 23), "end_hour": (0, 23)}
+
+def _config_value(key: str, default, v):
+    """Coerces v to the type of default; raises ValueError/TypeError on a value that does not fit."""
+    if isinstance(default, bool):
+        if isinstance(v, bool):
+            return v
+        if isinstance(v, int) and v in (0, 1):
+            return bool(v)
+        if isinstance(v, str) and v.strip().lower() in _TRUE_STRINGS + _FALSE_STRINGS:
+            return v.strip().lower() in _TRUE_STRINGS
+        raise ValueError(f"{key}: booléen attendu")
+    if isinstance(default, (int, float)):
+        if isinstance(v, bool) or not isinstance(v, (int, float, str)):
+            raise ValueError(f"{key}: nombre attendu")
+        x = float(v)
+        if x != x or x in (float("inf"), float("-inf")):
+            raise ValueError(f"{key}: nombre attendu")
+        if isinstance(default, int):
+            if x != int(x):
+                raise ValueError(f"{key}: entier attendu")
+            x = int(x)
+        lo, hi = _CONFIG_RANGES.get(key, (0, None))
+        if x < lo or (hi is not None and x > hi):
+            raise ValueError(f"{key}: hors bornes")
+        return x
+    if isinstance(default, list):
+        if isinstance(v, str):
+            items = v.split(",")
+        elif isinstance(v, list) and all(isinstance(p, str) for p in v):
+            items = v
+        else:
+            raise ValueError(f"{key}: liste de chaînes attendue")
+        return [p.strip() for p in items if p.strip()] or list(default)
+    if isinstance(default, dict):
+        if not isinstance(v, dict):
+            raise ValueError(f"{key}: objet attendu")
+        return dict(default, **{n: _config_value(n, default[n], v[n]) for n in default if n in v})
+    raise ValueError(key)
+
+def clean_config_values(data: dict) -> dict:
+    """
+    Keeps the known config keys, coerced to the type of their default value.
+    Raises ValueError on a value that cannot be coerced ("abc" for an hour).
+    """
+    if not isinstance(data, dict):
+        raise ValueError("objet attendu")
+    return {k: _config_value(k, CONFIG_DEFAULTS[k], v) for k, v in data.items() if k in CONFIG_DEFAULTS}
+
+def update_machine_config(machine_id: str, changes: dict, profile: str = None,
+                          reset_overrides: bool = False, notify: bool = True):
+    """
+    Applies config changes to one machine. Values equal to its profile are
+    dropped from the overrides, so the record stays a sparse diff.
+    """
+    rec = machine_configs.get(machine_id)
+    if rec is None:
+        ensure_config(machine_id)
+        rec = machine_configs[machine_id]
+    rec = dict(rec, overrides={} if reset_overrides else dict(rec["overrides"]))
+    if profile is not None:
+        rec["profile"] = profile
+    base = profile_base(rec["profile"])
+    rec["overrides"].update(changes)
+    rec["overrides"] = sparse_diff(rec["overrides"], base)
+    set_config_record(machine_id, rec)
+    save_machine_config(machine_id, notify=notify)
+
+def save_profile(name: str, settings: dict):
+    config_profiles[name] = {"name": name, "settings": sparse_diff(settings, CONFIG_DEFAULTS),
+                             "version": version_clock()}
+    store.put("config_profiles", name, config_profiles[name])
+    signal_machines(profile_members.get(name, ()))
+
+def profile_changed_members(since: int, skip) -> list:
+    """
+    Machines of the profiles changed after `since` that are not in `skip`:
+    the dashboard shows enabled / plugins, which may come from the profile.
+    Read lazily by /api/dashboard, so saving a profile stays O(1).
+    """
+    out = []
+    for name, p in config_profiles.items():
+        if (p.get("version") or 0) > since:
+            out.extend(mid for mid in profile_members.get(name, ()) if mid not in skip and mid in machines)
+    return out
+
+def select_machines(selector: dict) -> list:
+    """
+    {"machine_ids": [...]} | {"profile": name} | {"all": true}, in O(selected).
+    Raises ValueError on a malformed selector.
+    """
+    if not isinstance(selector, dict):
+        raise ValueError("selector: objet attendu")
+    ids = selector.get("machine_ids")
+    if ids:
+        if not isinstance(ids, list) or not all(isinstance(mid, str) for mid in ids):
+            raise ValueError("machine_ids: liste de chaînes attendue")
+        return [mid for mid in dict.fromkeys(ids) if mid in machines]
+    name = selector.get("profile")
+    if name:
+        if not isinstance(name, str):
+            raise ValueError("profile: chaîne attendue")
+        return list(profile_members.get(name, ()))
+    if selector.get("all") is True:
+        return list(machines)
+    return []
+
+_config_cache = {}  # machine_id -> (version, etag, body JSON), recalculé quand la version change
+
+def config_snapshot(machine_id: str, cfg: dict):
+    """
+    Returns (version, etag, body) for a machine config. The JSON body and its
+    sha256 (the ETag) are computed once per version, not on every request.
+    """
+    version = int(cfg.get("version") or 0)
+    cached = _config_cache.get(machine_id)
+    if cached is None or cached[0] != version:
+        body = json.dumps(cfg, sort_keys=True, separators=(",", ":"), default=str)
+        cached = (version, hashlib.sha256(body.encode("utf-8")).hexdigest(), body)
+        _config_cache[machine_id] = cached
+    return cached
+
 def json_or_none(s: str):
     s = (s or "").strip()
     if not s:
@@ -295,9 +1412,15 @@ def register():
     provided_client_id = (data.get("client_id") or "").strip()
     provided_machine_key = (data.get("machine_key") or "").strip()
 
+    with state_txn():
+        return _register_machine(machine_id, client_name, provided_client_id, provided_machine_key)
+
+def _register_machine(machine_id, client_name, provided_client_id, provided_machine_key):
     if provided_client_id and provided_machine_key:
         clients[provided_client_id] = {"machine_key": provided_machine_key, "created_at": now_iso()}
         machine_to_client[machine_id] = provided_client_id
+        store.put("clients", provided_client_id, clients[provided_client_id])
+        store.put("machine_to_client", machine_id, provided_client_id)
         auth_mode = "signed-ready"
         returned_client_id = provided_client_id
         returned_machine_key = None
@@ -306,12 +1429,15 @@ def register():
         generated_machine_key = str(uuid.uuid4()) + str(uuid.uuid4())
         clients[generated_client_id] = {"machine_key": generated_machine_key, "created_at": now_iso()}
         machine_to_client[machine_id] = generated_client_id
+        store.put("clients", generated_client_id, clients[generated_client_id])
+        store.put("machine_to_client", machine_id, generated_client_id)
         auth_mode = "generated"
         returned_client_id = generated_client_id
         returned_machine_key = generated_machine_key
 
     m = ensure_machine(machine_id, client_name)
     m["last_seen"] = now_iso()
+    save_machine(machine_id)
     ensure_config(machine_id)
 
     return jsonify({
@@ -330,18 +1456,24 @@ def register():
 def heartbeat():
     data = request.json or {}
     machine_id = data.get("machine_id")
-    cpu = float(data.get("cpu_percent", 0.0))
+    cpu = _float_or_none(data.get("cpu_percent")) or 0.0
 
     if not machine_id:
         return jsonify({"error": "machine_id manquant"}), 400
 
     verify_client_if_present(machine_id)
 
-    m = ensure_machine(machine_id)
-    m["last_seen"] = now_iso()
-    m["last_cpu"] = cpu
-    ensure_config(machine_id)
-    return jsonify({"status": "ok"})
+    with state_txn():
+        m = ensure_machine(machine_id)
+        m["last_seen"] = now_iso()
+        m["last_cpu"] = cpu
+        update_capabilities(m, data)
+        save_machine(machine_id)
+        cfg = ensure_config(machine_id)
+        extend_leases(machine_id, cfg)
+        version, etag, _ = config_snapshot(machine_id, cfg)
+    # le client ne refait GET /config que si la version a changé
+    return jsonify({"status": "ok", "config_version": version, "config_etag": etag})
 
 @app.route("/config", methods=["GET"])
 def get_config():
@@ -350,8 +1482,20 @@ def get_config():
         return jsonify({"error": "machine_id manquant"}), 400
 
     verify_client_if_present(machine_id)
-    ensure_machine(machine_id)
-    return jsonify(ensure_config(machine_id))
+    with state_lock:
+        cfg = known_config(machine_id)
+        if cfg is not None:
+            version, etag, body = config_snapshot(machine_id, cfg)
+    if cfg is None:
+        with state_txn():
+            ensure_machine(machine_id)
+            version, etag, body = config_snapshot(machine_id, ensure_config(machine_id))
+
+    resp = app.response_class(body, mimetype="application/json")
+    resp.set_etag(etag)  # If-None-Match -> 304 sans corps
+    resp.headers["X-Config-Version"] = str(version)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
 
 @app.route("/task", methods=["GET"])
 def get_task():
@@ -361,98 +1505,292 @@ def get_task():
 
     verify_client_if_present(machine_id)
 
-    ensure_machine(machine_id)
-    cfg = ensure_config(machine_id)
+    # machine connue sans travail possible : 204 sans transaction d'écriture
+    with state_lock:
+        cfg = known_config(machine_id)
+        if cfg is not None and (not cfg.get("enabled", True) or not may_dispatch(cfg)):
+            return ("", 204)
 
-    if not cfg.get("enabled", True):
-        return ("", 204)
+    with state_txn():
+        ensure_machine(machine_id)
+        cfg = ensure_config(machine_id)
 
-    for t in tasks.values():
-        if t["status"] == "pending":
-            t["status"] = "assigned"
-            t["assigned_to"] = machine_id
-            t["updated_at"] = now_iso()
+        if not cfg.get("enabled", True):
+            return ("", 204)
 
-            job = jobs.get(t["job_id"])
-            if job and job["status"] == "pending":
-                job["status"] = "running"
+        reap_expired_leases()
+        t = pop_pending_task(machine_task_types(machine_id, cfg), machine_caps(machine_id))
+        if t is None:
+            return ("", 204)
+        grant_lease(t, machine_id, cfg)
 
-            return jsonify({
-                "task_id": t["task_id"],
-                "payload": t["task_type"],      # client support: payload=type
-                "params": t.get("params", {}),  # plugin.run(params)
-                "size": t.get("size", 0),
-                "task_max_seconds": cfg.get("task_max_seconds", 30),
-                "post_task_sleep_seconds": cfg.get("post_task_sleep_seconds", 2),
-            })
+    return jsonify(task_response(t, cfg))
 
-    return ("", 204)
+def task_response(t: dict, cfg: dict) -> dict:
+    return {
+        "task_id": t["task_id"],
+        "payload": t["task_type"],      # client support: payload=type
+        "params": task_params(t, cfg),  # plugin.run(params)
+        "size": t.get("size", 0),
+        "task_max_seconds": cfg.get("task_max_seconds", 30),
+        "post_task_sleep_seconds": cfg.get("post_task_sleep_seconds", 2),
+        "lease_seconds": lease_seconds(cfg),
+        "attempt": t["attempts"],
+    }
 
-@app.route("/report", methods=["POST"])
-def report():
+@app.route("/poll", methods=["POST"])
+def poll():
+    """
+    Heartbeat (with capabilities, see update_capabilities) + config + task in
+    one request. The config is only returned when
+    its version differs from the client's `config_version`. Without work the
+    request is held up to `wait` seconds (max POLL_MAX_WAIT) until a task is
+    queued, instead of answering 204 and letting the client poll again.
+    On sync workers the hold is capped by POLL_SYNC_MAX_WAIT.
+    """
     data = request.json or {}
     machine_id = data.get("machine_id")
-    task_id = data.get("task_id")
-    seconds = int(data.get("seconds", 0))
-    result = data.get("result")
-
-    if not machine_id or task_id is None:
-        return jsonify({"error": "machine_id ou task_id manquant"}), 400
+    if not machine_id:
+        return jsonify({"error": "machine_id manquant"}), 400
 
     verify_client_if_present(machine_id)
 
-    m = ensure_machine(machine_id)
-    m["total_seconds"] += seconds
-    m["last_seen"] = now_iso()
-    ensure_config(machine_id)
+    known_version = data.get("config_version")
+    max_wait = POLL_MAX_WAIT if async_workers() else min(POLL_MAX_WAIT, POLL_SYNC_MAX_WAIT)
+    wait = min(max(0.0, _float_or_none(data.get("wait")) or 0.0), max_wait)
+    deadline = time.time() + wait
+
+    heartbeat_done = False
+    while True:
+        waiter = None
+        with state_txn():
+            if not heartbeat_done:
+                m = ensure_machine(machine_id)
+                m["last_seen"] = now_iso()
+                if "cpu_percent" in data:
+                    m["last_cpu"] = _float_or_none(data.get("cpu_percent")) or 0.0
+                update_capabilities(m, data)
+                save_machine(machine_id)
+                extend_leases(machine_id, ensure_config(machine_id))
+                heartbeat_done = True
+
+            cfg = ensure_config(machine_id)
+            enabled = cfg.get("enabled", True)
+            version = config_snapshot(machine_id, cfg)[0]
+            t = None
+            if enabled:
+                reap_expired_leases()
+                t = pop_pending_task(machine_task_types(machine_id, cfg), machine_caps(machine_id))
+                if t is not None:
+                    grant_lease(t, machine_id, cfg)
+            resp = {"status": "ok", "config_version": version, "task": None}
+            if version != known_version:
+                resp["config"] = cfg
+            if t is not None:
+                resp["task"] = task_response(t, cfg)
+            left = deadline - time.time()
+            # config modifiée ou machine stoppée : on répond tout de suite
+            if t is not None or "config" in resp or not enabled or left <= 0:
+                return jsonify(resp)
+            waiter = register_waiter(cfg.get("plugins_required") or (), machine_caps(machine_id), machine_id)
+        try:
+            waiter.wait(min(left, POLL_RECHECK_SECONDS))
+        finally:
+            unregister_waiter(waiter)
+
+def task_params(t: dict, cfg: dict):
+    """
+    Params passed to plugin.run(). The machine's plugin_workers is injected as
+    "workers" unless the job already set it, so one lease can use every core.
+    """
+    params = t.get("params", {})
+    workers = safe_int(cfg.get("plugin_workers", 1), default=1, min_value=1, max_value=PLUGIN_WORKERS_MAX)
+    if workers > 1 and isinstance(params, dict) and "workers" not in params:
+        params = dict(params, workers=workers)
+    return params
 
-    tasks_log.append({
+def apply_report(machine_id: str, task_id, seconds: int, result, elapsed: float = None):
+    """
+    Records one task result: task transition, job aggregate, results, tasks_log.
+    The caller holds state_txn() and has already credited the machine seconds.
+    The result payload is stored once, in results; tasks_log references it by seq.
+    """
+    log_entry = {
         "machine_id": machine_id,
         "task_id": task_id,
         "seconds": seconds,
-        "result": result,
         "reported_at": now_iso()
-    })
+    }
 
     if task_id in tasks:
         t = tasks[task_id]
-        t["status"] = "done"
+        # si la tâche était encore dans une file pending, son entrée
+        # devient obsolète et sera sautée par pop_pending_task()
+        first_report = (t["status"] != "done")
         t["seconds"] = t.get("seconds", 0) + seconds
-        t["result"] = result
-        t["updated_at"] = now_iso()
+        if first_report:
+            if t["status"] == "assigned":
+                release_lease(t)
+            t["result"] = result
+            set_task_status(t, "done")
+            if elapsed is None and isinstance(result, dict):
+                elapsed = _float_or_none(result.get("elapsed"))
+            observe_task_cost(t, seconds if elapsed is None else elapsed)
+        store.put("tasks", task_id, t)
 
         job = jobs.get(t["job_id"])
         if job:
             job["total_seconds"] += seconds
+            if first_report:
+                fold_task_result(job, result)
+            store.put("jobs", job["job_id"], job)
 
-            all_done = all(
-                (tt["status"] == "done")
-                for tt in tasks.values()
-                if tt["job_id"] == job["job_id"]
-            )
-            if all_done:
-                job["status"] = "done"
-
-            results.append({
+            row = {
                 "job_id": job["job_id"],
                 "task_id": task_id,
                 "machine_id": machine_id,
                 "seconds": seconds,
                 "timestamp": now_iso(),
                 "result": result
-            })
+            }
+            log_entry["result_seq"] = results.append(row)
+            store.append("results", row)
     else:
-        results.append({
+        row = {
             "job_id": None,
             "task_id": task_id,
             "machine_id": machine_id,
             "seconds": seconds,
             "timestamp": now_iso(),
             "result": result
-        })
+        }
+        log_entry["result_seq"] = results.append(row)
+        store.append("results", row)
+
+    tasks_log.append(log_entry)
+    store.append("tasks_log", log_entry)
+
+def _float_or_none(x):
+    try:
+        return float(x)
+    except Exception:
+        return None
+
+@app.route("/report", methods=["POST"])
+def report():
+    data = request.json or {}
+    machine_id = data.get("machine_id")
+    task_id = data.get("task_id")
+    seconds = int(data.get("seconds", 0))
+    result = data.get("result")
+
+    if not machine_id or task_id is None:
+        return jsonify({"error": "machine_id ou task_id manquant"}), 400
+
+    verify_client_if_present(machine_id)
+
+    with state_txn():
+        m = ensure_machine(machine_id)
+        m["total_seconds"] += seconds
+        m["last_seen"] = now_iso()
+        save_machine(machine_id)
+        ensure_config(machine_id)
+        apply_report(machine_id, task_id, seconds, result, _float_or_none(data.get("elapsed")))
 
     return jsonify({"status": "ok"})
 
+@app.route("/tasks/batch", methods=["GET"])
+def get_task_batch():
+    """
+    Leases up to `max` tasks in one round-trip, stopping once their estimated
+    cost would exceed `max_seconds` (default: the machine task_max_seconds).
+    At least one task is returned when work is available.
+    """
+    machine_id = request.args.get("machine_id")
+    if not machine_id:
+        return ("", 400)
+
+    verify_client_if_present(machine_id)
+
+    picked = []
+    with state_txn():
+        ensure_machine(machine_id)
+        cfg = ensure_config(machine_id)
+
+        if not cfg.get("enabled", True):
+            return ("", 204)
+
+        max_tasks = safe_int(request.args.get("max", 10), default=10, min_value=1, max_value=BATCH_MAX_TASKS)
+        max_seconds = _float_or_none(request.args.get("max_seconds")) or float(cfg.get("task_max_seconds", 30))
+
+        reap_expired_leases()
+        types, caps = machine_task_types(machine_id, cfg), machine_caps(machine_id)
+        budget = 0.0
+        while len(picked) < max_tasks:
+            t = pop_pending_task(types, caps)
+            if t is None:
+                break
+            est = estimate_task_seconds(t)
+            if picked and budget + est > max_seconds:
+                enqueue_task(t["task_id"], t["job_id"], front=True)
+                break
+            budget += est
+            picked.append(t)
+
+        # le bail couvre le lot entier (exécuté séquentiellement côté client)
+        for t in picked:
+            grant_lease(t, machine_id, cfg, extra_seconds=budget)
+
+    if not picked:
+        return ("", 204)
+
+    return jsonify({
+        "tasks": [{
+            "task_id": t["task_id"],
+            "payload": t["task_type"],
+            "params": task_params(t, cfg),
+            "size": t.get("size", 0),
+            "attempt": t["attempts"],
+        } for t in picked],
+        "estimated_seconds": round(budget, 3),
+        "task_max_seconds": cfg.get("task_max_seconds", 30),
+        "post_task_sleep_seconds": cfg.get("post_task_sleep_seconds", 2),
+        "lease_seconds": lease_seconds(cfg) + budget,
+    })
+
+@app.route("/report/batch", methods=["POST"])
+def report_batch():
+    """
+    Body: {"machine_id": "...", "results": [{"task_id", "seconds", "result", "elapsed"?}, ...]}
+    The whole body is signed once; every result is applied in a single pass.
+    """
+    data = request.json or {}
+    machine_id = data.get("machine_id")
+    items = data.get("results")
+
+    if not machine_id or not isinstance(items, list):
+        return jsonify({"error": "machine_id ou results manquant"}), 400
+    if len(items) > BATCH_MAX_REPORTS:
+        return jsonify({"error": f"max {BATCH_MAX_REPORTS} results par lot"}), 413
+
+    verify_client_if_present(machine_id)
+
+    applied = 0
+    with state_txn():
+        m = ensure_machine(machine_id)
+        m["last_seen"] = now_iso()
+        ensure_config(machine_id)
+        for it in items:
+            if not isinstance(it, dict) or it.get("task_id") is None:
+                continue
+            seconds = safe_int(it.get("seconds", 0), default=0, min_value=0)
+            m["total_seconds"] += seconds
+            apply_report(machine_id, it["task_id"], seconds, it.get("result"), _float_or_none(it.get("elapsed")))
+            applied += 1
+        save_machine(machine_id)
+
+    return jsonify({"status": "ok", "applied": applied})
+
 @app.route("/status", methods=["GET"])
 def status():
     total_seconds = sum(m["total_seconds"] for m in machines.values())
@@ -470,6 +1808,7 @@ def status():
 # =========================
 @app.route("/machines/<machine_id>/rename", methods=["POST"])
 @require_admin_route
+@with_state_txn
 def rename_machine(machine_id):
     if machine_id not in machines:
         return "Machine inconnue", 404
@@ -479,10 +1818,12 @@ def rename_machine(machine_id):
         return "Nom manquant", 400
 
     machines[machine_id]["display_name"] = new_name
+    save_machine(machine_id)
     return redirect(url_for("dashboard", token=request.args.get("token")))
 
 @app.route("/machines/<machine_id>/config", methods=["POST"])
 @require_admin_route
+@with_state_txn
 def set_machine_config(machine_id):
     ensure_machine(machine_id)
     cfg = ensure_config(machine_id)
@@ -493,63 +1834,252 @@ def set_machine_config(machine_id):
     new_name = (data.get("display_name") or "").strip()
     if new_name:
         machines[machine_id]["display_name"] = new_name
+        save_machine(machine_id)
+
+    # la config résolue n'est pas modifiée : on collecte les valeurs envoyées,
+    # puis on ne garde que celles qui diffèrent de la config actuelle. Le
+    # formulaire renvoie tous les champs pré-remplis : sans ce filtre, un
+    # changement de profil figerait les valeurs de l'ancien profil en overrides.
+    sent = {}
+    is_form = request.form is not None and request.form != {}
 
     # enabled : checkbox HTML -> présent = True, absent = False
-    if request.form is not None and request.form != {}:
-        cfg["enabled"] = ("enabled" in data)
+    if is_form:
+        sent["enabled"] = ("enabled" in data)
     else:
         if "enabled" in data:
-            cfg["enabled"] = bool(data.get("enabled"))
+            sent["enabled"] = data.get("enabled")
 
-    cfg["cpu_pause_threshold"] = float(data.get("cpu_pause_threshold", cfg.get("cpu_pause_threshold", 50.0)))
-    cfg["task_max_seconds"] = int(data.get("task_max_seconds", cfg.get("task_max_seconds", 30)))
-    cfg["post_task_sleep_seconds"] = int(data.get("post_task_sleep_seconds", cfg.get("post_task_sleep_seconds", 2)))
+    try:
+        if "cpu_pause_threshold" in data:
+            sent["cpu_pause_threshold"] = float(data.get("cpu_pause_threshold"))
+        if "task_max_seconds" in data:
+            sent["task_max_seconds"] = int(data.get("task_max_seconds"))
+        if "post_task_sleep_seconds" in data:
+            sent["post_task_sleep_seconds"] = int(data.get("post_task_sleep_seconds"))
+        if "plugin_workers" in data:
+            sent["plugin_workers"] = safe_int(data.get("plugin_workers"), default=1,
+                                              min_value=1, max_value=PLUGIN_WORKERS_MAX)
+
+        nm = cfg.get("night_mode") or {}
+        if is_form or any(k in data for k in ("night_enabled", "night_start", "night_end", "night_cpu")):
+            sent["night_mode"] = {
+                "enabled": ("night_enabled" in data) if is_form else data.get("night_enabled", nm.get("enabled", False)),
+                "start_hour": int(data.get("night_start", nm.get("start_hour", 23))),
+                "end_hour": int(data.get("night_end", nm.get("end_hour", 7))),
+                "cpu_pause_threshold": float(data.get("night_cpu", nm.get("cpu_pause_threshold", 70.0))),
+            }
 
-    # ✅ plugins requis (string "a,b,c" depuis dashboard)
-    raw = (data.get("plugins_required", "") or "").strip()
-    if raw:
-        cfg["plugins_required"] = [p.strip() for p in raw.split(",") if p.strip()]
-    else:
-        cfg["plugins_required"] = cfg.get("plugins_required") or ["montecarlo"]
-
-    nm = cfg.get("night_mode") or {}
-    cfg["night_mode"] = {
-        "enabled": ("night_enabled" in data) if (request.form is not None and request.form != {}) else bool(nm.get("enabled", False)),
-        "start_hour": int(data.get("night_start", nm.get("start_hour", 23))),
-        "end_hour": int(data.get("night_end", nm.get("end_hour", 7))),
-        "cpu_pause_threshold": float(data.get("night_cpu", nm.get("cpu_pause_threshold", 70.0))),
-    }
+        # plugins requis : "a,b,c" depuis le dashboard, liste en JSON ; vide = inchangé
+        plugins = data.get("plugins_required")
+        if isinstance(plugins, str):
+            plugins = plugins.strip()
+        if plugins:
+            sent["plugins_required"] = plugins
+        sent = clean_config_values(sent)  # "false" -> False, heures hors 0..23 refusées
+    except (TypeError, ValueError):
+        abort(400)
 
-    machine_configs[machine_id] = cfg
+    profile = (data.get("profile") or "").strip() or None
+    if profile and profile != DEFAULT_PROFILE and profile not in config_profiles:
+        abort(400)
+    changes = {k: v for k, v in sent.items() if cfg.get(k) != v}
+    update_machine_config(machine_id, changes, profile=profile)
     return redirect(url_for("dashboard", token=request.args.get("token")))
 
 @app.route("/machines/<machine_id>/stop", methods=["POST"])
 @require_admin_route
+@with_state_txn
 def stop_machine(machine_id):
     ensure_machine(machine_id)
-    cfg = ensure_config(machine_id)
-    cfg["enabled"] = False
-    machine_configs[machine_id] = cfg
+    update_machine_config(machine_id, {"enabled": False})
     return redirect(url_for("dashboard", token=request.args.get("token")))
 
 @app.route("/machines/<machine_id>/start", methods=["POST"])
 @require_admin_route
+@with_state_txn
 def start_machine(machine_id):
     ensure_machine(machine_id)
-    cfg = ensure_config(machine_id)
-    cfg["enabled"] = True
-    machine_configs[machine_id] = cfg
+    update_machine_config(machine_id, {"enabled": True})
     return redirect(url_for("dashboard", token=request.args.get("token")))
 
+@app.route("/machines/bulk-config", methods=["POST"])
+@require_admin_route
+@with_state_txn
+def bulk_machine_config():
+    """
+    One request for many machines:
+    {"selector": {"machine_ids": [...]} | {"profile": name} | {"all": true},
+     "profile": name?, "overrides": {...}?, "reset_overrides": bool?}
+    Cost is O(selected machines); only the selected machines' waiting /poll are woken.
+    """
+    data = request.json or {}
+    if not isinstance(data, dict) or not isinstance(data.get("profile") or "", str):
+        return jsonify({"error": "requête invalide"}), 400
+    profile = (data.get("profile") or "").strip() or None
+    if profile and profile != DEFAULT_PROFILE and profile not in config_profiles:
+        return jsonify({"error": "profil inconnu"}), 404
+    try:
+        changes = clean_config_values(data.get("overrides") or {})
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"overrides invalides ({e})"}), 400
+    try:
+        selected = select_machines(data.get("selector") or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    for machine_id in selected:
+        update_machine_config(machine_id, changes, profile=profile,
+                              reset_overrides=bool(data.get("reset_overrides")), notify=False)
+    signal_machines(selected)
+    return jsonify({"status": "ok", "updated": len(selected)})
+
+def profile_view(name: str) -> dict:
+    p = config_profiles.get(name) or {"name": name, "settings": {}, "version": 0}
+    return dict(p, machines=len(profile_members.get(name, ())))
+
+def profile_names() -> list:
+    return [DEFAULT_PROFILE] + sorted(n for n in config_profiles if n != DEFAULT_PROFILE)
+
+@app.route("/profiles.json")
+@require_admin_route
+def profiles_json():
+    with state_lock:
+        return jsonify({"defaults": CONFIG_DEFAULTS, "profiles": [profile_view(n) for n in profile_names()]})
+
+@app.route("/profiles/<name>", methods=["POST"])
+@require_admin_route
+@with_state_txn
+def set_profile(name):
+    """
+    Patches a profile: {"key": value} sets a setting, {"key": null} falls back
+    to default_config(). Every machine of the profile sees it at its next request.
+    """
+    data = request.json or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "objet JSON attendu"}), 400
+    settings = dict(config_profiles.get(name, {}).get("settings", {}))
+    for k in [k for k, v in data.items() if v is None]:
+        settings.pop(k, None)
+    try:
+        settings.update(clean_config_values({k: v for k, v in data.items() if v is not None}))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"valeurs invalides ({e})"}), 400
+    save_profile(name, settings)
+    return jsonify(profile_view(name))
+
 
 # =========================
 #   JOBS (ADMIN) — MULTI PLUGINS
 # =========================
+def add_task(task_id: str, job_id: str, task_type: str, size: int, params: dict):
+    """Creates a pending task and queues it for dispatch."""
+    t = _new_task(task_id, job_id, task_type, size, params)
+    job = jobs.get(job_id)
+    if job:
+        job_counts(job)["pending"] += 1
+    enqueue_task(task_id, job_id)
+    return t
+
+def _new_task(task_id: str, job_id: str, task_type: str, size: int, params: dict):
+    tasks[task_id] = {
+        "task_id": task_id,
+        "job_id": job_id,
+        "task_type": task_type,
+        "size": size,
+        "params": params,
+        "status": "pending",
+        "assigned_to": None,
+        "created_at": now_iso(),
+        "updated_at": None,
+        "seconds": 0,
+        "result": None,
+        "attempts": 0,
+        "lease_expires": None
+    }
+    index_task(tasks[task_id])
+    store.put("tasks", task_id, tasks[task_id])
+    return tasks[task_id]
+
+# --- optimizer_grid : grille paresseuse
+# Le job ne stocke que la spec compacte de la grille (axes + curseur "next").
+# La combinaison i se décode en base mixte (dernier axe = chiffre de poids
+# faible, même ordre qu'itertools.product) et la tâche {job_id}_cfg_{i+1}
+# n'est créée qu'au moment où /task la distribue. Les compteurs pending du
+# job incluent dès la soumission les tâches pas encore matérialisées.
+def grid_remaining(job: dict) -> int:
+    spec = job.get("grid")
+    if not spec:
+        return 0
+    return max(0, int(job.get("total_chunks", 0)) - int(spec.get("next", 0)))
+
+def grid_combo(spec: dict, index: int) -> dict:
+    digits = []
+    for vals in reversed(spec["values"]):
+        index, r = divmod(index, len(vals))
+        digits.append(vals[r])
+    digits.reverse()
+    return dict(zip(spec["keys"], digits))
+
+def next_grid_task(job: dict):
+    """Materializes the next combination (or chunk) of a lazy grid job, or None."""
+    if not grid_remaining(job):
+        return None
+    spec = job["grid"]
+    i = int(spec["next"])
+    spec["next"] = i + 1
+    store.put("jobs", job["job_id"], job)
+
+    chunk_count = spec.get("chunk_count")
+    if chunk_count:
+        # mode tranches : le plugin évalue [start, end) via chunk_index/chunk_count
+        params = {
+            "grid": dict(zip(spec["keys"], spec["values"])),
+            "metric": spec["metric"],
+            "seed": spec["seed"],
+            "chunk_index": i + 1,
+            "chunk_count": chunk_count,
+            "top_k": AGG_TOP_K
+        }
+        size = grid_chunk_len(spec["combos"], i + 1, chunk_count)
+        return _new_task(f"{job['job_id']}_chunk_{i + 1}", job["job_id"], job["task_type"], size, params)
+
+    params = {
+        "params": grid_combo(spec, i),
+        "metric": spec["metric"],
+        "seed": spec["seed"]
+    }
+    return _new_task(f"{job['job_id']}_cfg_{i + 1}", job["job_id"], job["task_type"], 0, params)
+
+# --- optimizer_grid : découpage adaptatif en tranches
+# "chunking": "adaptive" dans les params du job => une tâche par tranche de
+# grille au lieu d'une par combinaison. La taille de tranche vise
+# target_task_seconds à partir du coût mesuré par combinaison
+# (task_costs["optimizer_grid"] : les tâches tranche ont size = nb de combos).
+GRID_TARGET_TASK_SECONDS = float(os.getenv("GRID_TARGET_TASK_SECONDS", "20"))
+GRID_COMBO_COST_DEFAULT = 5e-6  # s / combinaison avant toute mesure
+
+def grid_chunk_len(n_total: int, chunk_index: int, chunk_count: int) -> int:
+    # même répartition que _chunk_slice() du plugin (chunks 1..rem ont base+1)
+    base, rem = divmod(n_total, chunk_count)
+    return base + 1 if chunk_index <= rem else base
+
+def grid_chunk_count(n_total: int, extra: dict) -> int:
+    chunk_size = safe_int(extra.get("chunk_size"), default=0, min_value=0)
+    if not chunk_size:
+        target = _float_or_none(extra.get("target_task_seconds"))
+        if not (target and 0 < target < float("inf")):
+            target = GRID_TARGET_TASK_SECONDS
+        cost = task_costs.get("optimizer_grid") or GRID_COMBO_COST_DEFAULT
+        chunk_size = max(1, int(target / cost))
+    return max(1, -(-n_total // chunk_size))
+
 def create_tasks_for_job(job_id: str, task_type: str, total_chunks: int, size: int, params_json_text: str):
     """
     - montecarlo: uses size as n (per chunk) + seed=i+1 (compat with your old behavior),
       and merges extra params from JSON if provided.
-    - optimizer_grid: expects params JSON describing a grid; generates 1 task per combination.
+    - optimizer_grid: expects params JSON describing a grid; 1 task per combination,
+      generated lazily at dispatch time (the job only keeps the grid spec).
       If JSON is not a grid, uses it as payload for all tasks.
     - other plugins: uses params JSON as-is for every chunk.
     """
@@ -561,19 +2091,7 @@ def create_tasks_for_job(job_id: str, task_type: str, total_chunks: int, size: i
             params = {"n": size, "seed": i + 1}
             if isinstance(extra, dict):
                 params.update(extra)
-            tasks[task_id] = {
-                "task_id": task_id,
-                "job_id": job_id,
-                "task_type": task_type,
-                "size": size,
-                "params": params,
-                "status": "pending",
-                "assigned_to": None,
-                "created_at": now_iso(),
-                "updated_at": None,
-                "seconds": 0,
-                "result": None
-            }
+            add_task(task_id, job_id, task_type, size, params)
         return
 
     if task_type == "optimizer_grid":
@@ -581,10 +2099,13 @@ def create_tasks_for_job(job_id: str, task_type: str, total_chunks: int, size: i
         # {
         #   "grid": {"alpha":[...], "beta":[...], "gamma":[...]},
         #   "metric":"minimize_loss",
-        #   "seed":42
+        #   "seed":42,
+        #   "chunking":"adaptive",        (optional, else 1 task per combination)
+        #   "target_task_seconds":20      (optional, or a fixed "chunk_size")
         # }
         # Plugin expects payload:
         # {"params":{...}, "metric":..., "seed":...}
+        # or, chunked: {"grid":{...}, "chunk_index":i, "chunk_count":n, "metric":..., "seed":...}
         metric = "minimize_loss"
         seed = 42
         grid = None
@@ -594,155 +2115,47 @@ def create_tasks_for_job(job_id: str, task_type: str, total_chunks: int, size: i
             seed = extra.get("seed", seed)
             grid = extra.get("grid")
 
-        def cartesian_product(keys, lists):
-            out = [{}]
-            for k, vals in zip(keys, lists):
-                new_out = []
-                for base in out:
-                    for v in vals:
-                        d = dict(base)
-                        d[k] = v
-                        new_out.append(d)
-                out = new_out
-            return out
-
-        combos = []
+        keys = []
+        lists = []
         if isinstance(grid, dict) and grid:
-            keys = []
-            lists = []
             for k, vals in grid.items():
                 if isinstance(vals, list) and vals:
                     keys.append(k)
                     lists.append(vals)
-            if keys and lists:
-                combos = cartesian_product(keys, lists)
-
-        # If grid produced combos, override total_chunks to combos count.
-        if combos:
-            # Update job total_chunks to match actual combos count
-            jobs[job_id]["total_chunks"] = len(combos)
-            for i, combo in enumerate(combos, start=1):
-                task_id = f"{job_id}_cfg_{i}"
-                params = {
-                    "params": combo,
-                    "metric": metric,
-                    "seed": seed
-                }
-                tasks[task_id] = {
-                    "task_id": task_id,
-                    "job_id": job_id,
-                    "task_type": task_type,
-                    "size": 0,
-                    "params": params,
-                    "status": "pending",
-                    "assigned_to": None,
-                    "created_at": now_iso(),
-                    "updated_at": None,
-                    "seconds": 0,
-                    "result": None
-                }
+
+        # If the grid is valid, store it as a lazy spec: O(axes) at submit time,
+        # tasks are generated by next_grid_task() when dispatched.
+        if keys:
+            total = 1
+            for vals in lists:
+                total *= len(vals)
+            job = jobs[job_id]
+            spec = {"keys": keys, "values": lists, "metric": metric, "seed": seed, "next": 0, "combos": total}
+            n_tasks = total
+            chunking = extra.get("chunking")
+            if isinstance(chunking, str) and chunking.strip().lower() == "adaptive":
+                n_tasks = spec["chunk_count"] = grid_chunk_count(total, extra)
+            # Update job total_chunks to match actual task count
+            job["total_chunks"] = n_tasks
+            job["grid"] = spec
+            job_counts(job)["pending"] += n_tasks
+            mark_job_ready(job_id)
             return
 
         # Fallback: no grid => behave like "generic" with total_chunks
         for i in range(total_chunks):
             task_id = f"{job_id}_part_{i+1}"
             params = extra if isinstance(extra, dict) else {}
-            tasks[task_id] = {
-                "task_id": task_id,
-                "job_id": job_id,
-                "task_type": task_type,
-                "size": 0,
-                "params": params,
-                "status": "pending",
-                "assigned_to": None,
-                "created_at": now_iso(),
-                "updated_at": None,
-                "seconds": 0,
-                "result": None
-            }
+            add_task(task_id, job_id, task_type, 0, params)
         return
 
     # Generic plugins
     for i in range(total_chunks):
         task_id = f"{job_id}_part_{i+1}"
         params = extra if isinstance(extra, dict) else {}
-        tasks[task_id] = {
-            "task_id": task_id,
-            "job_id": job_id,
-            "task_type": task_type,
-            "size": 0,
-            "params": params,
-            "status": "pending",
-            "assigned_to": None,
-            "created_at": now_iso(),
-            "updated_at": None,
-            "seconds": 0,
-            "result": None
-        }
-
-@app.route("/submit", methods=["GET", "POST"])
-@require_admin_route
-def submit_job():
-    token = request.args.get("token")
-    available = plugin_types_available()
-    if not available:
-        available = ["montecarlo"]  # safe fallback
+        add_task(task_id, job_id, task_type, 0, params)
 
-    if request.method == "POST":
-        name = (request.form.get("name") or "Job sans nom").strip()
-        description = (request.form.get("description") or "").strip()
-
-        task_type = (request.form.get("task_type") or "montecarlo").strip()
-        if task_type not in available:
-            # refuse unknown types to avoid typos
-            task_type = "montecarlo"
-
-        total_chunks = safe_int(request.form.get("chunks", 5), default=5, min_value=1, max_value=500)
-        size = safe_int(request.form.get("size", 200000), default=200000, min_value=0)
-        params_json_text = (request.form.get("params_json") or "").strip()
-
-        # quick JSON validation if provided
-        if params_json_text:
-            parsed = json_or_none(params_json_text)
-            if parsed is None:
-                return "Params JSON invalides (doit être un objet JSON).", 400
-            if not isinstance(parsed, dict):
-                return "Params JSON invalides (doit être un objet JSON).", 400
-
-        job_id = str(uuid.uuid4())[:8]
-        jobs[job_id] = {
-            "job_id": job_id,
-            "name": name,
-            "description": description,
-            "task_type": task_type,
-            "total_chunks": total_chunks,
-            "created_at": now_iso(),
-            "status": "pending",
-            "total_seconds": 0
-        }
-
-        create_tasks_for_job(
-            job_id=job_id,
-            task_type=task_type,
-            total_chunks=total_chunks,
-            size=size,
-            params_json_text=params_json_text
-        )
-
-        return redirect(url_for("jobs_view", token=token))
-
-    # Defaults for UI
-    default_params_by_type = {
-        "montecarlo": "{}",
-        "optimizer_grid": json.dumps({
-            "grid": {"alpha": [0.1, 0.2, 0.3, 0.4], "beta": [1, 2, 3], "gamma": [10, 15, 20]},
-            "metric": "minimize_loss",
-            "seed": 42
-        }, indent=2),
-        "hello": "{}"
-    }
-
-    html = """
+SUBMIT_TEMPLATE = app.jinja_env.from_string("""
     <h1>Soumettre un job GreenIdle</h1>
     <p><a href="/dashboard?token={{ token }}">⬅ Retour dashboard</a></p>
 
@@ -761,6 +2174,11 @@ def submit_job():
         </select>
         <div style="color:#666; font-size:12px; margin-top:6px;">
           Le type correspond au nom du plugin dans <code>server_plugins/</code> (sans .py).
+          Machines capables : <b id="capable_count"></b>
+        </div>
+        <div id="capable_warn" style="color:#b00; font-size:12px; margin-top:6px; display:none;">
+          ⚠️ Aucune machine n'a ce type dans ses <code>plugins_required</code> : le job restera en attente.
+          Ajoutez-le au profil (POST /profiles/&lt;nom&gt;) ou à la config des machines.
         </div>
         <br>
 
@@ -776,7 +2194,8 @@ def submit_job():
         <textarea name="params_json" id="params_json" rows="10" cols="80" style="font-family: monospace;">{{ default_json }}</textarea><br>
         <div style="color:#666; font-size:12px; margin-top:6px;">
           <b>montecarlo</b> : JSON fusionné dans params (ex: {"idle":true})<br>
-          <b>optimizer_grid</b> : attend {"grid":{...}, "metric":"minimize_loss", "seed":42} et génère 1 tâche par combinaison.
+          <b>optimizer_grid</b> : attend {"grid":{...}, "metric":"minimize_loss", "seed":42} et génère 1 tâche par combinaison ;
+          avec "chunking":"adaptive", 1 tâche par tranche dimensionnée pour durer ~target_task_seconds.
         </div>
         <br>
 
@@ -785,8 +2204,11 @@ def submit_job():
 
     <script>
       const defaults = {{ defaults|safe }};
+      const capable = {{ capable|tojson }};
       function onTypeChange(){
         const t = document.getElementById("task_type").value;
+        document.getElementById("capable_count").textContent = capable[t] || 0;
+        document.getElementById("capable_warn").style.display = capable[t] ? "none" : "";
         const sizeBlock = document.getElementById("size_block");
         const chunks = document.getElementById("chunks");
         const params = document.getElementById("params_json");
@@ -809,133 +2231,375 @@ def submit_job():
       // initialize on load
       onTypeChange();
     </script>
-    """
-    return render_template_string(
-        html,
+""")
+
+@app.route("/submit", methods=["GET", "POST"])
+@require_admin_route
+def submit_job():
+    token = request.args.get("token")
+    available = plugin_types_available()
+    if not available:
+        available = ["montecarlo"]  # safe fallback
+
+    if request.method == "POST":
+        name = (request.form.get("name") or "Job sans nom").strip()
+        description = (request.form.get("description") or "").strip()
+
+        task_type = (request.form.get("task_type") or "montecarlo").strip()
+        if task_type not in available:
+            # refuse unknown types to avoid typos
+            task_type = "montecarlo"
+
+        total_chunks = safe_int(request.form.get("chunks", 5), default=5, min_value=1, max_value=500)
+        size = safe_int(request.form.get("size", 200000), default=200000, min_value=0)
+        params_json_text = (request.form.get("params_json") or "").strip()
+
+        # quick JSON validation if provided
+        if params_json_text:
+            parsed = json_or_none(params_json_text)
+            if parsed is None:
+                return "Params JSON invalides (doit être un objet JSON).", 400
+            if not isinstance(parsed, dict):
+                return "Params JSON invalides (doit être un objet JSON).", 400
+            if not isinstance(parsed.get("chunking", ""), str):
+                return "Params JSON invalides (\"chunking\" doit être une chaîne, ex: \"adaptive\").", 400
+
+        job_id = str(uuid.uuid4())[:8]
+        job = {
+            "job_id": job_id,
+            "name": name,
+            "description": description,
+            "task_type": task_type,
+            "total_chunks": total_chunks,
+            "created_at": now_iso(),
+            "status": "pending",
+            "total_seconds": 0,
+            "counts": {st: 0 for st in TASK_STATUSES}
+        }
+        # ressources minimales d'une machine pour ce job (params JSON "min_cores" / "min_ram_mb")
+        requires = {k: safe_int(parsed.get(f"min_{k}"), default=0, min_value=0)
+                    for k in ("cores", "ram_mb") if params_json_text and parsed.get(f"min_{k}")}
+        if requires:
+            job["requires"] = requires
+
+        with state_txn():
+            jobs[job_id] = job
+            index_job(job)
+            create_tasks_for_job(
+                job_id=job_id,
+                task_type=task_type,
+                total_chunks=total_chunks,
+                size=size,
+                params_json_text=params_json_text
+            )
+            store.put("jobs", job_id, jobs[job_id])
+            capable = capable_machines(task_type, job)
+
+        if not capable:
+            # job accepté mais aucune machine connue ne le prendra (plugins_required / ressources)
+            return redirect(url_for("jobs_view", token=token, no_capable=job_id))
+        return redirect(url_for("jobs_view", token=token))
+
+    # Defaults for UI
+    default_params_by_type = {
+        "montecarlo": "{}",
+        "optimizer_grid": json.dumps({
+            "grid": {"alpha": [0.1, 0.2, 0.3, 0.4], "beta": [1, 2, 3], "gamma": [10, 15, 20]},
+            "metric": "minimize_loss",
+            "seed": 42,
+            "chunking": "adaptive",
+            "target_task_seconds": GRID_TARGET_TASK_SECONDS
+        }, indent=2),
+        "hello": "{}"
+    }
+
+    with state_lock:
+        capable = {t: capable_machines(t) for t in available}
+
+    return render_template(
+        SUBMIT_TEMPLATE,
         token=token,
         available=available,
+        capable=capable,
         default_json=default_params_by_type.get("montecarlo", "{}"),
         defaults=json.dumps(default_params_by_type)
     )
 
-@app.route("/jobs")
+def page_jobs():
+    """
+    Newest-first page of jobs, filtered by ?status= / ?type=.
+    Keyset cursor ?before=<created_at>|<job_id>. Returns (jobs, next_cursor).
+    """
+    status = (request.args.get("status") or "").strip()
+    task_type = (request.args.get("type") or "").strip()
+    before = request.args.get("before") or None
+    limit = arg_limit()
+
+    # on parcourt l'index le plus étroit, l'autre filtre est vérifié job par job
+    lists = [job_keys_by.get(b, []) for b in (("status", status), ("type", task_type)) if b[1]]
+    keys = min(lists, key=len) if lists else job_keys
+    i = bisect.bisect_left(keys, before) if before else len(keys)
+    rows = []
+    while i > 0 and len(rows) <= limit:
+        i -= 1
+        j = jobs.get(keys[i].rsplit("|", 1)[1])
+        if j is None:
+            continue
+        if (not status or j.get("status") == status) and (not task_type or j.get("task_type") == task_type):
+            rows.append(j)
+    if len(rows) > limit:
+        return rows[:limit], job_key(rows[limit - 1])
+    return rows, None
+
+@app.route("/jobs.json")
 @require_admin_route
-def jobs_view():
-    token = request.args.get("token")
-    html = """
+def jobs_json():
+    rows, nxt = page_jobs()
+    return jsonify({"jobs": rows, "next": nxt})
+
+JOBS_TEMPLATE = app.jinja_env.from_string("""
     <h1>Jobs GreenIdle</h1>
     <p>
       <a href="/dashboard?token={{ token }}">⬅ Dashboard</a> |
-      <a href="/submit?token={{ token }}">➕ Nouveau job</a>
+      <a href="/submit?token={{ token }}">➕ Nouveau job</a> |
+      <a href="/jobs.json?{{ request.query_string.decode() }}">JSON</a>
     </p>
 
+    <form method="get">
+      <input type="hidden" name="token" value="{{ token }}">
+      Status <input name="status" value="{{ request.args.get('status','') }}" size="8">
+      Type <input name="type" value="{{ request.args.get('type','') }}" size="12">
+      <button type="submit">Filtrer</button>
+    </form>
+
+    {% if request.args.get('no_capable') %}
+      <p style="color:#b00;">⚠️ Job {{ request.args.get('no_capable') }} créé, mais aucune machine connue ne peut le prendre
+      (type absent de ses <code>plugins_required</code>, ou ressources insuffisantes). Il restera en attente.</p>
+    {% endif %}
+
     {% if jobs %}
     <table border="1" cellspacing="0" cellpadding="6">
       <tr>
-        <th>ID</th><th>Nom</th><th>Type</th><th>Status</th><th>Chunks</th><th>Secondes</th><th>Créé le</th><th>Détail</th>
+        <th>ID</th><th>Nom</th><th>Type</th><th>Status</th><th>Chunks</th>
+        <th>Pending</th><th>Assignées</th><th>Terminées</th><th>Échouées</th>
+        <th>Secondes</th><th>Créé le</th><th>Détail</th>
       </tr>
       {% for j in jobs %}
+      {% set c = j.counts or {} %}
       <tr>
         <td>{{ j.job_id }}</td>
         <td>{{ j.name }}</td>
         <td>{{ j.task_type }}</td>
         <td>{{ j.status }}</td>
         <td>{{ j.total_chunks }}</td>
+        <td>{{ c.pending or 0 }}</td>
+        <td>{{ c.assigned or 0 }}</td>
+        <td>{{ c.done or 0 }}</td>
+        <td>{{ c.failed or 0 }}</td>
         <td>{{ j.total_seconds }}</td>
         <td>{{ j.created_at }}</td>
         <td><a href="/jobs/{{ j.job_id }}?token={{ token }}">Voir</a></td>
       </tr>
       {% endfor %}
     </table>
+    {% if next %}
+      <p><a href="{{ url_for('jobs_view', token=token, status=request.args.get('status',''), type=request.args.get('type',''), before=next) }}">Plus anciens ➡</a></p>
+    {% endif %}
     {% else %}
       <p>Aucun job (après redeploy Render, la mémoire repart à zéro). Clique sur “Nouveau job”.</p>
     {% endif %}
-    """
-    return render_template_string(html, jobs=list(jobs.values()), token=token)
+""")
 
-def aggregate_job_result(job_id: str):
-    job = jobs.get(job_id)
-    if not job:
-        return None
+@app.route("/jobs")
+@require_admin_route
+def jobs_view():
+    token = request.args.get("token")
+    rows, nxt = page_jobs()
+    return render_template(JOBS_TEMPLATE, jobs=rows, next=nxt, token=token)
 
-    ttype = job.get("task_type")
+# =========================
+#   AGRÉGATION INCRÉMENTALE (registre par type)
+# =========================
+# Chaque type de tâche déclare un reducer : init() -> état JSON-able,
+# fold(état, résultat) à chaque tâche terminée (appelé dans /report),
+# view(état) -> dict affiché par /jobs/<id>. L'état vit dans job["agg"],
+# donc lire l'agrégat coûte O(1). Le fold n'a lieu qu'au passage d'une tâche
+# à "done" : un rapport en double ne compte jamais deux fois.
+# Un fold ne doit jamais lever : la tâche est déjà "done" quand il tourne,
+# donc une valeur malformée est ignorée (comme _grid_insert le fait déjà).
+AGGREGATORS = {}  # task_type -> {"init": fn, "fold": fn, "view": fn}
+AGG_TOP_K = 10
+
+def register_aggregator(task_type: str, init, fold, view):
+    AGGREGATORS[task_type] = {"init": init, "fold": fold, "view": view}
+
+def _get_aggregator(task_type: str):
+    return AGGREGATORS.get(task_type) or AGGREGATORS["*"]
+
+def job_agg_state(job: dict) -> dict:
+    st = job.get("agg")
+    if st is None:
+        st = job["agg"] = _get_aggregator(job.get("task_type"))["init"]()
+    return st
+
+def fold_task_result(job: dict, result):
+    try:
+        _get_aggregator(job.get("task_type"))["fold"](job_agg_state(job), result)
+    except Exception:
+        # filet pour un reducer fautif : le rapport reste enregistré
+        app.logger.exception("agrégation du job %s ignorée pour ce résultat", job.get("job_id"))
 
-    if ttype == "montecarlo":
-        inside_sum = 0
-        total_sum = 0
-        for t in tasks.values():
-            if t["job_id"] == job_id and t.get("result"):
-                r = t["result"] or {}
-                inside_sum += int(r.get("inside", 0))
-                total_sum += int(r.get("total", 0))
+# --- montecarlo : sommes inside / total
+def _mc_init():
+    return {"inside": 0, "total": 0}
 
-        if total_sum <= 0:
-            return {"type": "montecarlo", "pi": None, "inside": inside_sum, "total": total_sum}
+def _mc_fold(st, r):
+    if not r or not isinstance(r, dict):
+        return
+    try:
+        inside, total = int(r.get("inside", 0)), int(r.get("total", 0))
+    except (TypeError, ValueError, OverflowError):
+        return
+    if inside < 0 or inside > total:
+        return
+    st["inside"] += inside
+    st["total"] += total
 
-        pi_est = 4.0 * inside_sum / float(total_sum)
-        return {"type": "montecarlo", "pi": pi_est, "inside": inside_sum, "total": total_sum}
+def _mc_view(st):
+    inside_sum, total_sum = st["inside"], st["total"]
+    if total_sum <= 0:
+        return {"type": "montecarlo", "pi": None, "inside": inside_sum, "total": total_sum}
+    pi_est = 4.0 * inside_sum / float(total_sum)
+    return {"type": "montecarlo", "pi": pi_est, "inside": inside_sum, "total": total_sum}
 
-    if ttype == "optimizer_grid":
-        best = None
-        tested = 0
-        for t in tasks.values():
-            if t["job_id"] != job_id:
-                continue
-            if t.get("status") != "done":
-                continue
-            r = t.get("result") or {}
-            if not isinstance(r, dict):
-                continue
-            tested += 1
-            score = r.get("score")
-            if score is None:
-                continue
-            try:
-                score = float(score)
-            except Exception:
-                continue
+register_aggregator("montecarlo", _mc_init, _mc_fold, _mc_view)
 
-            # metric: minimize_loss by default (lower is better); maximize_score => higher better
-            metric = (r.get("metric") or "minimize_loss").strip().lower()
-            better = False
-            if best is None:
-                better = True
-            else:
-                if metric == "maximize_score":
-                    better = score > float(best.get("score"))
-                else:
-                    better = score < float(best.get("score"))
-
-            if better:
-                best = {
-                    "score": score,
-                    "metric": metric,
-                    "tested_params": r.get("tested_params") or r.get("params") or r.get("tested") or r.get("tested_params")
-                }
-
-        return {"type": "optimizer_grid", "tested": tested, "best": best}
-
-    # Generic aggregation: count done + last result sample
-    done = 0
-    last = None
-    for t in tasks.values():
-        if t["job_id"] == job_id and t.get("status") == "done":
-            done += 1
-            last = t.get("result")
-    return {"type": ttype, "done": done, "sample_result": last}
+# --- optimizer_grid : meilleur score courant + top-k
+def _grid_init():
+    return {"tested": 0, "metric": None, "top": []}
 
-@app.route("/jobs/<job_id>")
-@require_admin_route
-def job_detail(job_id):
-    token = request.args.get("token")
+def _grid_better(a: float, b: float, metric: str) -> bool:
+    # metric: minimize_loss by default (lower is better); maximize_score => higher better
+    return a > b if metric == "maximize_score" else a < b
+
+def _grid_fold(st, r):
+    if not isinstance(r, dict):
+        return
+    metric = r.get("metric")
+    if not isinstance(metric, str) or not metric.strip():
+        metric = st["metric"] or "minimize_loss"
+    metric = metric.strip().lower()
+    if st["metric"] is None:
+        st["metric"] = metric
+
+    if r.get("mode") == "grid":
+        # tranche : top-k local (ou meilleur candidat seul) + nombre de combinaisons évaluées
+        st["tested"] += safe_int(r.get("evaluated", 0), default=0, min_value=0)
+        if not r.get("evaluated"):
+            return
+        top = r.get("top")
+        if not isinstance(top, list) or not top:
+            top = [{"score": r.get("best_score"), "params": r.get("best_params")}]
+        for e in top:
+            if isinstance(e, dict):
+                _grid_insert(st, e.get("score"), e.get("params"), metric)
+        return
+
+    st["tested"] += 1
+    _grid_insert(st, r.get("score"), r.get("tested_params") or r.get("params") or r.get("tested"), metric)
+
+def _grid_insert(st, score, params, metric):
+    if score is None:
+        return
+    try:
+        score = float(score)
+    except Exception:
+        return
+
+    top = st["top"]
+    if len(top) >= AGG_TOP_K and not _grid_better(score, top[-1]["score"], metric):
+        return
+    entry = {
+        "score": score,
+        "tested_params": params
+    }
+    # insertion triée (k petit) : à score égal, le premier arrivé reste devant
+    i = len(top)
+    while i > 0 and _grid_better(score, top[i - 1]["score"], metric):
+        i -= 1
+    top.insert(i, entry)
+    del top[AGG_TOP_K:]
+
+def _grid_view(st):
+    best = None
+    if st["top"]:
+        best = dict(st["top"][0], metric=st["metric"])
+    return {"type": "optimizer_grid", "tested": st["tested"], "best": best, "top": st["top"]}
+
+register_aggregator("optimizer_grid", _grid_init, _grid_fold, _grid_view)
+
+# --- générique : nombre de tâches terminées + dernier résultat
+def _generic_init():
+    return {"done": 0, "sample_result": None}
+
+def _generic_fold(st, r):
+    st["done"] += 1
+    st["sample_result"] = r
+
+register_aggregator("*", _generic_init, _generic_fold, lambda st: dict(st))
+
+def aggregate_job_result(job_id: str):
     job = jobs.get(job_id)
     if not job:
-        return "Job introuvable", 404
+        return None
 
-    job_tasks = [t for t in tasks.values() if t["job_id"] == job_id]
-    agg = aggregate_job_result(job_id)
+    view = _get_aggregator(job.get("task_type"))["view"](job_agg_state(job))
+    if view.get("type") is None:
+        view["type"] = job.get("task_type")
+    return view
+
+def page_job_tasks(job_id: str):
+    """
+    Tasks of a job in creation order, filtered by ?status= / ?machine=.
+    Keyset cursor ?after=<position>; the status filter bisects the per-job
+    sorted positions of that status. Returns (tasks, next_cursor).
+    """
+    status = (request.args.get("status") or "").strip()
+    machine = (request.args.get("machine") or "").strip()
+    after = safe_int(request.args.get("after"), default=-1, min_value=-1)
+    limit = arg_limit()
+    ids = job_task_ids.get(job_id, [])
+
+    def ok(p):
+        return not machine or tasks[ids[p]].get("assigned_to") == machine
+
+    if status:
+        sorted_pos = job_status_pos.get(job_id, {}).get(status, [])
+        cand = (sorted_pos[i] for i in range(bisect.bisect_right(sorted_pos, after), len(sorted_pos)))
+    else:
+        cand = range(after + 1, len(ids))
+    positions = []
+    for p in cand:
+        if ok(p):
+            positions.append(p)
+            if len(positions) > limit:
+                break
+
+    rows = [tasks[ids[p]] for p in positions[:limit]]
+    if len(positions) > limit:
+        return rows, positions[limit - 1]
+    return rows, None
+
+@app.route("/jobs/<job_id>.json")
+@require_admin_route
+def job_detail_json(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "job introuvable"}), 404
+    rows, nxt = page_job_tasks(job_id)
+    return jsonify({"job": job, "agg": aggregate_job_result(job_id), "tasks": rows, "next": nxt})
 
-    html = """
+JOB_DETAIL_TEMPLATE = app.jinja_env.from_string("""
     <h1>Job {{ job.job_id }}</h1>
     <p><a href="/jobs?token={{ token }}">⬅ Retour</a></p>
 
@@ -943,6 +2607,10 @@ def job_detail(job_id):
     <p><b>Type:</b> {{ job.task_type }}</p>
     <p><b>Status:</b> {{ job.status }}</p>
     <p><b>Secondes:</b> {{ job.total_seconds }}</p>
+    <p><b>Progression:</b>
+      {{ counts.done }} terminées / {{ counts.assigned }} assignées /
+      {{ counts.pending }} pending / {{ counts.failed }} échouées
+    </p>
 
     {% if agg %}
       <h2>Résultat agrégé</h2>
@@ -956,6 +2624,14 @@ def job_detail(job_id):
           <p><b>Meilleur score:</b> {{ agg.best.score }} (metric={{ agg.best.metric }})</p>
           <p><b>Meilleurs paramètres:</b></p>
           <pre style="margin:0; white-space:pre-wrap;">{{ agg.best.tested_params }}</pre>
+          {% if agg.top|length > 1 %}
+            <p><b>Top {{ agg.top|length }}:</b></p>
+            <ol>
+              {% for e in agg.top %}
+                <li>{{ e.score }} — <code>{{ e.tested_params }}</code></li>
+              {% endfor %}
+            </ol>
+          {% endif %}
         {% else %}
           <p>Aucun score agrégé pour l'instant.</p>
         {% endif %}
@@ -965,28 +2641,88 @@ def job_detail(job_id):
     {% endif %}
 
     <h2>Tâches</h2>
+    <form method="get">
+      <input type="hidden" name="token" value="{{ token }}">
+      Status <input name="status" value="{{ request.args.get('status','') }}" size="8">
+      Machine <input name="machine" value="{{ request.args.get('machine','') }}" size="12">
+      <button type="submit">Filtrer</button>
+      <a href="/jobs/{{ job.job_id }}.json?{{ request.query_string.decode() }}">JSON</a>
+    </form>
     <table border="1" cellspacing="0" cellpadding="6">
-      <tr><th>Task</th><th>Status</th><th>Assignée à</th><th>Secondes</th><th>Result</th></tr>
+      <tr><th>Task</th><th>Status</th><th>Assignée à</th><th>Essais</th><th>Secondes</th><th>Result</th></tr>
       {% for t in job_tasks %}
         <tr>
           <td>{{ t.task_id }}</td>
           <td>{{ t.status }}</td>
           <td>{{ t.assigned_to }}</td>
+          <td>{{ t.attempts }}</td>
           <td>{{ t.seconds }}</td>
           <td><pre style="margin:0; white-space:pre-wrap;">{{ t.result }}</pre></td>
         </tr>
       {% endfor %}
     </table>
-    """
-    return render_template_string(html, job=job, job_tasks=job_tasks, token=token, agg=agg)
+    {% if next is not none %}
+      <p><a href="{{ url_for('job_detail', job_id=job.job_id, token=token, status=request.args.get('status',''), machine=request.args.get('machine',''), after=next) }}">Suivantes ➡</a></p>
+    {% endif %}
+""")
 
-@app.route("/results")
+@app.route("/jobs/<job_id>")
 @require_admin_route
-def results_view():
+def job_detail(job_id):
     token = request.args.get("token")
-    html = """
+    job = jobs.get(job_id)
+    if not job:
+        return "Job introuvable", 404
+
+    job_tasks, nxt = page_job_tasks(job_id)
+    counts = job_counts(job)
+    agg = aggregate_job_result(job_id)
+
+    return render_template(JOB_DETAIL_TEMPLATE, job=job, job_tasks=job_tasks, next=nxt, counts=counts, token=token, agg=agg)
+
+def page_results():
+    """
+    Newest-first page of results, filtered by ?job= / ?machine= / ?task= and
+    the ?since= / ?until= time range. Keyset cursor ?before=<seq>; the seq is
+    a ns timestamp so the time range bounds the scan (memory, then segments).
+    Returns (rows, next_cursor).
+    """
+    job_id = (request.args.get("job") or "").strip()
+    machine = (request.args.get("machine") or "").strip()
+    task_id = (request.args.get("task") or "").strip()
+    before = safe_int(request.args.get("before"), default=0, min_value=0) or None
+    since, until = arg_time_ns("since"), arg_time_ns("until")
+    if until is not None:
+        before = min(before, until + 1) if before else until + 1
+
+    if task_id and not job_id and task_id in tasks:
+        job_id = tasks[task_id].get("job_id") or ""  # borne aussi les segments lus
+    where = {k: v for k, v in (("job_id", job_id), ("machine_id", machine), ("task_id", task_id)) if v}
+
+    return results.page(before=before, limit=arg_limit(), where=where,
+                        after=None if since is None else since - 1)
+
+@app.route("/results.json")
+@require_admin_route
+def results_json():
+    rows, nxt = page_results()
+    return jsonify({"results": rows, "next": nxt})
+
+RESULTS_TEMPLATE = app.jinja_env.from_string("""
     <h1>Résultats</h1>
-    <p><a href="/dashboard?token={{ token }}">⬅ Dashboard</a></p>
+    <p>
+      <a href="/dashboard?token={{ token }}">⬅ Dashboard</a> |
+      <a href="/results.json?{{ request.query_string.decode() }}">JSON</a>
+    </p>
+
+    <form method="get">
+      <input type="hidden" name="token" value="{{ token }}">
+      Job <input name="job" value="{{ request.args.get('job','') }}" size="10">
+      Machine <input name="machine" value="{{ request.args.get('machine','') }}" size="12">
+      Depuis <input name="since" value="{{ request.args.get('since','') }}" size="19">
+      Jusqu'à <input name="until" value="{{ request.args.get('until','') }}" size="19">
+      <button type="submit">Filtrer</button>
+    </form>
 
     {% if rows %}
     <table border="1" cellspacing="0" cellpadding="6">
@@ -1002,114 +2738,188 @@ def results_view():
         </tr>
       {% endfor %}
     </table>
+    {% if next_before %}
+      <p><a href="{{ url_for('results_view', token=token, job=request.args.get('job',''), machine=request.args.get('machine',''), since=request.args.get('since',''), until=request.args.get('until',''), before=next_before) }}">Plus anciens ➡</a></p>
+    {% endif %}
     {% else %}
       <p>Aucun résultat.</p>
     {% endif %}
-    """
-    return render_template_string(html, rows=results, token=token)
+""")
+
+@app.route("/results")
+@require_admin_route
+def results_view():
+    token = request.args.get("token")
+    # page la plus récente d'abord ; ?before=<seq> pour remonter (mémoire puis segments)
+    rows, next_before = page_results()
+    return render_template(RESULTS_TEMPLATE, rows=rows, next_before=next_before, token=token)
 
 # =========================
 #   DASHBOARD (ADMIN)
 # =========================
-@app.route("/dashboard")
-@require_admin_route
-def dashboard():
-    token = request.args.get("token")
-    total_seconds = sum(m["total_seconds"] for m in machines.values())
-    total_hours = round(total_seconds / 3600, 4)
+# Lignes d'une machine (ligne + formulaire de config) : incluses par le
+# dashboard et renvoyées seules par /api/dashboard/rows pour patcher la table
+MACHINE_ROWS_TEMPLATE = app.jinja_env.from_string("""
+{% set cfg = configs.get(m.machine_id, {}) %}
+{% set nm = cfg.get("night_mode", {}) %}
+<tr class="row"
+    data-machine="{{ m.machine_id }}"
+    data-display="{{ m.display_name or '' }}"
+    data-enabled="{{ 'true' if cfg.get('enabled', True) else 'false' }}"
+    data-plugins="{{ (cfg.get('plugins_required') or ['montecarlo'])|join(',') }}"
+    data-name="{{ (m.display_name or '')|lower }}"
+    data-id="{{ (m.machine_id or '')|lower }}"
+    data-lastseen="{{ m.last_seen or '' }}"
+    data-cpu="{{ m.last_cpu or 0 }}"
+    data-seconds="{{ m.total_seconds or 0 }}">
+  <td>
+    <div class="machineName">{{ m.display_name }}</div>
+    <div class="machineId">{{ m.machine_id }} — profil: {{ cfg.get('profile', 'default') }} — plugins_required: {{ (cfg.get('plugins_required') or ['montecarlo'])|join(',') }}</div>
+  </td>
+
+  <td>
+    <span class="pill off" data-pill>—</span>
+  </td>
+
+  <td data-f="cpu">{{ m.last_cpu }}%</td>
+
+  <td>
+    <span data-ago>—</span><br>
+    <span class="hint" style="font-size:12px;" data-f="lastseen">{{ m.last_seen }}</span>
+  </td>
+
+  <td data-f="seconds">{{ m.total_seconds }}</td>
+
+  <td>
+    <div class="btnrow">
+      {% if cfg.get("enabled", True) %}
+        <form method="post" action="/machines/{{ m.machine_id }}/stop?token={{ token }}">
+          <button class="btn subtle" type="submit">Pause</button>
+        </form>
+      {% else %}
+        <form method="post" action="/machines/{{ m.machine_id }}/start?token={{ token }}">
+          <button class="btn" type="submit">Reprendre</button>
+        </form>
+      {% endif %}
+
+      <button class="btn" type="button" onclick="toggleCfg('{{ m.machine_id }}')">Configurer</button>
+    </div>
+  </td>
+</tr>
+
+<tr id="cfg-{{ m.machine_id }}" style="display:none;">
+  <td colspan="6">
+    <div class="card" style="margin:10px 0;">
+      <div class="card-h">
+        <div class="title">Configuration — {{ m.display_name }}</div>
+        <div class="hint">{{ m.machine_id }}</div>
+      </div>
+      <div class="card-b">
+        <form method="post" action="/machines/{{ m.machine_id }}/config?token={{ token }}">
+          <div class="check">
+            <input type="checkbox" name="enabled" {% if cfg.get("enabled", True) %}checked{% endif %}>
+            <span>Machine active</span>
+          </div>
 
-    html = """
+          <div class="formgrid">
+            <div class="fsmall">
+              <label>CPU max (%)</label>
+              <input type="number" name="cpu_pause_threshold"
+                     value="{{ cfg.get('cpu_pause_threshold',50) }}"
+                     min="10" max="95" step="5">
+            </div>
+
+            <div class="fsmall">
+              <label>Durée max tâche (s)</label>
+              <input type="number" name="task_max_seconds"
+                     value="{{ cfg.get('task_max_seconds',30) }}"
+                     min="5" max="300">
+            </div>
+
+            <div class="fsmall">
+              <label>Pause après tâche (s)</label>
+              <input type="number" name="post_task_sleep_seconds"
+                     value="{{ cfg.get('post_task_sleep_seconds',2) }}"
+                     min="0" max="30">
+            </div>
+
+            <div class="fsmall">
+              <label>Processus par tâche</label>
+              <input type="number" name="plugin_workers"
+                     value="{{ cfg.get('plugin_workers',1) }}"
+                     min="1" max="256">
+            </div>
+
+            <div class="f">
+              <label>Profil</label>
+              <select name="profile">
+                {% for p in profile_names %}
+                <option value="{{ p }}" {% if p == cfg.get('profile', 'default') %}selected{% endif %}>{{ p }}</option>
+                {% endfor %}
+              </select>
+            </div>
+
+            <div class="f">
+              <label>Plugins requis (séparés par virgules)</label>
+              <input type="text" name="plugins_required"
+                     value="{{ (cfg.get('plugins_required') or ['montecarlo'])|join(',') }}">
+            </div>
+          </div>
+
+          <div class="line"></div>
+
+          <div class="check">
+            <input type="checkbox" name="night_enabled" {% if nm.get("enabled") %}checked{% endif %}>
+            <span>Mode nuit machine</span>
+          </div>
+
+          <div class="formgrid">
+            <div class="fsmall">
+              <label>Nuit début (0-23)</label>
+              <input type="number" name="night_start"
+                     value="{{ nm.get('start_hour',23) }}"
+                     min="0" max="23">
+            </div>
+            <div class="fsmall">
+              <label>Nuit fin (0-23)</label>
+              <input type="number" name="night_end"
+                     value="{{ nm.get('end_hour',7) }}"
+                     min="0" max="23">
+            </div>
+            <div class="fsmall">
+              <label>CPU nuit (%)</label>
+              <input type="number" name="night_cpu"
+                     value="{{ nm.get('cpu_pause_threshold',70) }}"
+                     min="20" max="100" step="5">
+            </div>
+          </div>
+
+          <div class="line"></div>
+
+          <div class="formgrid">
+            <div class="f">
+              <label>Renommer</label>
+              <div style="display:flex; gap:8px;">
+                <input type="text" name="display_name" placeholder="Nouveau nom" style="flex:1;">
+                <button class="btn" type="submit">Appliquer config</button>
+              </div>
+            </div>
+          </div>
+        </form>
+      </div>
+    </div>
+  </td>
+</tr>
+""")
+
+DASHBOARD_TEMPLATE = app.jinja_env.from_string("""
     <!DOCTYPE html>
     <html lang="fr">
     <head>
         <meta charset="utf-8">
         <meta name="viewport" content="width=device-width, initial-scale=1">
         <title>{{ app_name }} - Dashboard</title>
-        <style>
-            :root[data-theme="light"]{
-              --bg:#f7f7f8; --card:#ffffff; --text:#111827; --muted:#6b7280; --line:#e5e7eb;
-              --pillOn:#e7f7ee; --pillIdle:#fff7e6; --pillOff:#f3f4f6;
-              --btn:#ffffff;
-            }
-            :root[data-theme="dark"]{
-              --bg:#0b1220; --card:#0f1a2c; --text:#e5e7eb; --muted:#93a4bf; --line:#1f2a3d;
-              --pillOn:#0f2b1b; --pillIdle:#2a2416; --pillOff:#1b2233;
-              --btn:#0f1a2c;
-            }
-            body{background:var(--bg); color:var(--text); font-family:system-ui,-apple-system,Segoe UI,Roboto; margin:0;}
-            .page{max-width:1200px; margin:0 auto; padding:22px;}
-            .topbar{display:flex; justify-content:space-between; align-items:center; gap:16px; margin-bottom:18px;}
-            h1{margin:0; font-size:20px;}
-            .sub{color:var(--muted); font-size:13px; margin-top:4px;}
-            .top-actions{display:flex; align-items:center; gap:10px;}
-            .hint{color:var(--muted); font-size:13px;}
-
-            .kpis{display:grid; grid-template-columns:repeat(5,1fr); gap:12px; margin-bottom:14px;}
-            .kpi{background:var(--card); border:1px solid var(--line); border-radius:14px; padding:12px;}
-            .kpi-title{color:var(--muted); font-size:12px;}
-            .kpi-value{font-size:18px; font-weight:650; margin-top:6px;}
-
-            .nav{display:flex; flex-wrap:wrap; gap:10px; margin:10px 0 12px;}
-            .chip{display:inline-flex; align-items:center; gap:8px; background:var(--card); border:1px solid var(--line);
-                 border-radius:999px; padding:8px 12px; color:var(--text); text-decoration:none; font-size:13px;}
-            .chip:hover{filter:brightness(1.05);}
-
-            .controls{display:flex; gap:10px; margin:12px 0 12px;}
-            .search, select{background:var(--card); color:var(--text); border:1px solid var(--line);
-                           border-radius:12px; padding:10px 12px;}
-            .search{flex:1;}
-
-            .card{grid-column: span 12; background:var(--card); border:1px solid var(--line); border-radius:16px; overflow:hidden;}
-            .card-h{display:flex; justify-content:space-between; align-items:center; padding:12px 14px; border-bottom:1px solid var(--line);}
-            .card-h .title{font-weight:650;}
-            .card-b{padding:14px;}
-
-            table{width:100%; border-collapse:collapse;}
-            thead th{color:var(--muted); text-align:left; font-size:12px; font-weight:600; padding:12px; border-bottom:1px solid var(--line);}
-            tbody td{padding:12px; border-bottom:1px solid var(--line); vertical-align:top;}
-            tbody tr:hover{filter:brightness(1.05);}
-
-            .machineName{font-weight:650;}
-            .machineId{color:var(--muted); font-size:12px; margin-top:2px;}
-
-            .pill{display:inline-block; padding:6px 10px; border-radius:999px; font-size:12px; border:1px solid var(--line);}
-            .pill.on{background:var(--pillOn);}
-            .pill.idle{background:var(--pillIdle);}
-            .pill.off{background:var(--pillOff);}
-
-            .btn{background:var(--btn); color:var(--text); border:1px solid var(--line); border-radius:10px; padding:8px 10px; cursor:pointer;}
-            .btn:hover{filter:brightness(1.08);}
-            .btn.subtle{opacity:.85;}
-            .btnrow{display:flex; gap:8px; justify-content:flex-end; flex-wrap:wrap;}
-
-            .formgrid{display:grid; grid-template-columns:repeat(12,1fr); gap:10px;}
-            .f{grid-column: span 6;}
-            .f label{display:block; color:var(--muted); font-size:12px; margin-bottom:6px;}
-            .f input[type="text"], .f input[type="number"]{
-              width:100%; background:var(--card); color:var(--text); border:1px solid var(--line);
-              border-radius:10px; padding:9px 10px;
-            }
-            .fsmall{grid-column: span 4;}
-            .line{height:1px; background:var(--line); margin:12px 0;}
-            .check{display:flex; gap:10px; align-items:center; color:var(--text); margin:2px 0 10px;}
-            .check span{color:var(--muted); font-size:13px;}
-
-            .switch{position:relative; display:inline-block; width:44px; height:24px;}
-            .switch input{display:none;}
-            .slider{position:absolute; inset:0; background:var(--card); border:1px solid var(--line); border-radius:999px;}
-            .slider:before{content:""; position:absolute; height:18px; width:18px; left:3px; top:2.5px; background:var(--text);
-                          border-radius:50%; transition:.2s; opacity:.8;}
-            .switch input:checked + .slider:before{transform:translateX(20px);}
-
-            @media (max-width: 980px){
-              .kpis{grid-template-columns:repeat(2,1fr);}
-              thead{display:none;}
-              table, tbody, tr, td{display:block; width:100%;}
-              tbody td{border-bottom:none;}
-              tbody tr{border-bottom:1px solid var(--line); padding:10px;}
-              .f, .fsmall{grid-column: span 12;}
-            }
-        </style>
+        <link rel="stylesheet" href="{{ asset_url('dashboard.css') }}">
     </head>
     <body>
       <div class="page">
@@ -1131,15 +2941,15 @@ def dashboard():
         <section class="kpis">
           <div class="kpi">
             <div class="kpi-title">Machines</div>
-            <div class="kpi-value">{{ machines|length }}</div>
+            <div class="kpi-value" id="kpiMachines">{{ kpis.machines }}</div>
           </div>
           <div class="kpi">
             <div class="kpi-title">Heures cumulées</div>
-            <div class="kpi-value">{{ total_hours }}</div>
+            <div class="kpi-value" id="kpiHours">{{ kpis.total_hours }}</div>
           </div>
           <div class="kpi">
             <div class="kpi-title">Jobs</div>
-            <div class="kpi-value">{{ jobs_count }}</div>
+            <div class="kpi-value" id="kpiJobs">{{ kpis.jobs }}</div>
           </div>
           <div class="kpi">
             <div class="kpi-title">En ligne (estim.)</div>
@@ -1187,139 +2997,9 @@ def dashboard():
                   <th style="text-align:right;">Actions</th>
                 </tr>
               </thead>
-              <tbody id="rows">
+              <tbody id="rows" data-version="{{ version }}">
               {% for m in machines %}
-                {% set cfg = configs.get(m.machine_id, {}) %}
-                {% set nm = cfg.get("night_mode", {}) %}
-                <tr class="row"
-                    data-machine="{{ m.machine_id }}"
-                    data-name="{{ (m.display_name or '')|lower }}"
-                    data-id="{{ (m.machine_id or '')|lower }}"
-                    data-lastseen="{{ m.last_seen or '' }}"
-                    data-cpu="{{ m.last_cpu or 0 }}"
-                    data-seconds="{{ m.total_seconds or 0 }}">
-                  <td>
-                    <div class="machineName">{{ m.display_name }}</div>
-                    <div class="machineId">{{ m.machine_id }} — plugins_required: {{ (cfg.get('plugins_required') or ['montecarlo'])|join(',') }}</div>
-                  </td>
-
-                  <td>
-                    <span class="pill off" data-pill>—</span>
-                  </td>
-
-                  <td>{{ m.last_cpu }}%</td>
-
-                  <td>
-                    <span data-ago>—</span><br>
-                    <span class="hint" style="font-size:12px;">{{ m.last_seen }}</span>
-                  </td>
-
-                  <td>{{ m.total_seconds }}</td>
-
-                  <td>
-                    <div class="btnrow">
-                      {% if cfg.get("enabled", True) %}
-                        <form method="post" action="/machines/{{ m.machine_id }}/stop?token={{ token }}">
-                          <button class="btn subtle" type="submit">Pause</button>
-                        </form>
-                      {% else %}
-                        <form method="post" action="/machines/{{ m.machine_id }}/start?token={{ token }}">
-                          <button class="btn" type="submit">Reprendre</button>
-                        </form>
-                      {% endif %}
-
-                      <button class="btn" type="button" onclick="toggleCfg('{{ m.machine_id }}')">Configurer</button>
-                    </div>
-                  </td>
-                </tr>
-
-                <tr id="cfg-{{ m.machine_id }}" style="display:none;">
-                  <td colspan="6">
-                    <div class="card" style="margin:10px 0;">
-                      <div class="card-h">
-                        <div class="title">Configuration — {{ m.display_name }}</div>
-                        <div class="hint">{{ m.machine_id }}</div>
-                      </div>
-                      <div class="card-b">
-                        <form method="post" action="/machines/{{ m.machine_id }}/config?token={{ token }}">
-                          <div class="check">
-                            <input type="checkbox" name="enabled" {% if cfg.get("enabled", True) %}checked{% endif %}>
-                            <span>Machine active</span>
-                          </div>
-
-                          <div class="formgrid">
-                            <div class="fsmall">
-                              <label>CPU max (%)</label>
-                              <input type="number" name="cpu_pause_threshold"
-                                     value="{{ cfg.get('cpu_pause_threshold',50) }}"
-                                     min="10" max="95" step="5">
-                            </div>
-
-                            <div class="fsmall">
-                              <label>Durée max tâche (s)</label>
-                              <input type="number" name="task_max_seconds"
-                                     value="{{ cfg.get('task_max_seconds',30) }}"
-                                     min="5" max="300">
-                            </div>
-
-                            <div class="fsmall">
-                              <label>Pause après tâche (s)</label>
-                              <input type="number" name="post_task_sleep_seconds"
-                                     value="{{ cfg.get('post_task_sleep_seconds',2) }}"
-                                     min="0" max="30">
-                            </div>
-
-                            <div class="f">
-                              <label>Plugins requis (séparés par virgules)</label>
-                              <input type="text" name="plugins_required"
-                                     value="{{ (cfg.get('plugins_required') or ['montecarlo'])|join(',') }}">
-                            </div>
-                          </div>
-
-                          <div class="line"></div>
-
-                          <div class="check">
-                            <input type="checkbox" name="night_enabled" {% if nm.get("enabled") %}checked{% endif %}>
-                            <span>Mode nuit machine</span>
-                          </div>
-
-                          <div class="formgrid">
-                            <div class="fsmall">
-                              <label>Nuit début (0-23)</label>
-                              <input type="number" name="night_start"
-                                     value="{{ nm.get('start_hour',23) }}"
-                                     min="0" max="23">
-                            </div>
-                            <div class="fsmall">
-                              <label>Nuit fin (0-23)</label>
-                              <input type="number" name="night_end"
-                                     value="{{ nm.get('end_hour',7) }}"
-                                     min="0" max="23">
-                            </div>
-                            <div class="fsmall">
-                              <label>CPU nuit (%)</label>
-                              <input type="number" name="night_cpu"
-                                     value="{{ nm.get('cpu_pause_threshold',70) }}"
-                                     min="20" max="100" step="5">
-                            </div>
-                          </div>
-
-                          <div class="line"></div>
-
-                          <div class="formgrid">
-                            <div class="f">
-                              <label>Renommer</label>
-                              <div style="display:flex; gap:8px;">
-                                <input type="text" name="display_name" placeholder="Nouveau nom" style="flex:1;">
-                                <button class="btn" type="submit">Appliquer config</button>
-                              </div>
-                            </div>
-                          </div>
-                        </form>
-                      </div>
-                    </div>
-                  </td>
-                </tr>
+                {% include machine_rows_template %}
               {% endfor %}
               </tbody>
             </table>
@@ -1327,137 +3007,98 @@ def dashboard():
         </section>
       </div>
 
-      <script>
-        // Theme
-        const saved = localStorage.getItem("theme") || "dark";
-        document.documentElement.dataset.theme = saved;
-        const darkToggle = document.getElementById("darkToggle");
-        darkToggle.checked = (saved === "dark");
-        darkToggle.addEventListener("change", () => {
-          const t = darkToggle.checked ? "dark" : "light";
-          document.documentElement.dataset.theme = t;
-          localStorage.setItem("theme", t);
-        });
-
-        function timeAgo(iso) {
-          if (!iso) return "—";
-          const t = new Date(iso).getTime();
-          const s = Math.floor((Date.now() - t) / 1000);
-          if (s < 60) return `${s}s`;
-          const m = Math.floor(s/60);
-          if (m < 60) return `${m}min`;
-          const h = Math.floor(m/60);
-          if (h < 24) return `${h}h`;
-          const d = Math.floor(h/24);
-          return `${d}j`;
-        }
-
-        function computeStatus(lastSeenIso, cpu) {
-          if (!lastSeenIso) return {label:"Offline", cls:"off", age: 999999};
-          const ageSec = (Date.now() - new Date(lastSeenIso).getTime()) / 1000;
-          if (ageSec > 180) return {label:"Offline", cls:"off", age: ageSec};
-          if (Number(cpu) <= 10) return {label:"Idle", cls:"idle", age: ageSec};
-          return {label:"Online", cls:"on", age: ageSec};
-        }
-
-        function refreshDerived() {
-          const rows = Array.from(document.querySelectorAll("tr.row"));
-          let online = 0, cpuSum = 0, cpuCount = 0;
-
-          rows.forEach(r => {
-            const lastSeen = r.dataset.lastseen;
-            const cpu = Number(r.dataset.cpu || 0);
-            const st = computeStatus(lastSeen, cpu);
-
-            const pill = r.querySelector("[data-pill]");
-            pill.textContent = st.label;
-            pill.classList.remove("on","idle","off");
-            pill.classList.add(st.cls);
-
-            const ago = r.querySelector("[data-ago]");
-            ago.textContent = timeAgo(lastSeen);
-
-            if (st.cls !== "off") online += 1;
-            cpuSum += cpu; cpuCount += 1;
-          });
-
-          document.getElementById("kpiOnline").textContent = online;
-          document.getElementById("kpiCpu").textContent = cpuCount ? (cpuSum/cpuCount).toFixed(1) + "%" : "—";
-        }
-
-        function toggleCfg(machineId) {
-          const el = document.getElementById("cfg-" + machineId);
-          if (!el) return;
-          el.style.display = (el.style.display === "none") ? "" : "none";
-        }
+      <script src="{{ asset_url('dashboard.js') }}"></script>
+    </body>
+    </html>
+""")
 
-        // search + sort (client-side)
-        const search = document.getElementById("search");
-        const sort = document.getElementById("sort");
-
-        function applyFilterSort(){
-          const q = (search.value || "").toLowerCase().trim();
-          const rows = Array.from(document.querySelectorAll("tr.row"));
-
-          rows.forEach(r => {
-            const name = r.dataset.name || "";
-            const id = r.dataset.id || "";
-            const show = !q || name.includes(q) || id.includes(q);
-            r.style.display = show ? "" : "none";
-
-            // cache aussi la ligne config associée (robuste)
-            const cfg = document.getElementById("cfg-" + r.dataset.machine);
-            if (cfg && !show) cfg.style.display = "none";
-          });
-
-          const key = sort.value;
-          const parent = document.getElementById("rows");
-
-          const sortable = rows
-            .filter(r => r.style.display !== "none")
-            .map(r => {
-              const cfg = document.getElementById("cfg-" + r.dataset.machine);
-              return {r, cfg};
-            });
-
-          sortable.sort((a,b) => {
-            if (key === "name") return (a.r.dataset.name||"").localeCompare(b.r.dataset.name||"");
-            if (key === "last_cpu") return Number(a.r.dataset.cpu||0) - Number(b.r.dataset.cpu||0);
-            if (key === "total_seconds") return Number(b.r.dataset.seconds||0) - Number(a.r.dataset.seconds||0);
-            // last_seen desc
-            return new Date(b.r.dataset.lastseen||0).getTime() - new Date(a.r.dataset.lastseen||0).getTime();
-          });
-
-          sortable.forEach(({r,cfg}) => {
-            parent.appendChild(r);
-            if (cfg) parent.appendChild(cfg);
-          });
-        }
+def dashboard_kpis() -> dict:
+    return {
+        "machines": dash_kpis["machines"],
+        "total_hours": round(dash_kpis["total_seconds"] / 3600, 4),
+        "jobs": len(jobs),
+    }
 
-        search.addEventListener("input", applyFilterSort);
-        sort.addEventListener("change", applyFilterSort);
+def dashboard_machine(machine_id: str) -> dict:
+    m = machines[machine_id]
+    cfg = resolve_config(machine_id) if machine_id in machine_configs else CONFIG_DEFAULTS
+    return {
+        "machine_id": machine_id,
+        "display_name": m.get("display_name"),
+        "last_seen": m.get("last_seen"),
+        "last_cpu": m.get("last_cpu"),
+        "total_seconds": m.get("total_seconds"),
+        "enabled": bool(cfg.get("enabled", True)),
+        "plugins_required": cfg.get("plugins_required") or ["montecarlo"],
+    }
 
-        refreshDerived();
-        applyFilterSort();
-        setInterval(refreshDerived, 4000);
-      </script>
-    </body>
-    </html>
+@app.route("/api/dashboard")
+@require_admin_route
+def api_dashboard():
     """
+    Machines changed since ?since=<version> (all of them without since) + KPIs.
+    The returned version is taken before reading, so nothing is missed by the next call.
+    """
+    since = safe_int(request.args.get("since"), default=0, min_value=0)
+    with state_lock:
+        version = version_clock()
+        changed = []
+        for machine_id in reversed(machine_versions):
+            if machine_versions[machine_id] <= since:
+                break
+            changed.append(machine_id)
+        changed.reverse()
+        changed += profile_changed_members(since, set(changed))
+        rows = [dashboard_machine(mid) for mid in changed]
+        kpis = dashboard_kpis()
+    # en chaîne : une version ns (~1.8e18) dépasse 2**53 et serait arrondie par JS
+    return jsonify({"version": str(version), "kpis": kpis, "machines": rows})
+
+@app.route("/api/dashboard/rows")
+@require_admin_route
+def api_dashboard_rows():
+    """HTML rows (machine + config form) for ?ids=a,b, used by the JS for new or reconfigured machines."""
+    ids = [i for i in (request.args.get("ids") or "").split(",") if i in machines]
+    return render_template(
+        DASHBOARD_ROWS_TEMPLATE,
+        machines=[machines[i] for i in ids],
+        configs=resolved_configs(ids),
+        profile_names=profile_names(),
+        token=request.args.get("token"),
+        machine_rows_template=MACHINE_ROWS_TEMPLATE,
+    )
+
+DASHBOARD_ROWS_TEMPLATE = app.jinja_env.from_string(
+    "{% for m in machines %}{% include machine_rows_template %}{% endfor %}"
+)
 
-    return render_template_string(
-        html,
+@app.route("/dashboard")
+@require_admin_route
+def dashboard():
+    token = request.args.get("token")
+    with state_lock:
+        version = version_clock()  # avant lecture : le premier delta reprend tout ce qui suit
+        kpis = dashboard_kpis()
+        rows = list(machines.values())
+        configs = resolved_configs(machines)
+
+    return render_template(
+        DASHBOARD_TEMPLATE,
         app_name=APP_NAME,
-        machines=list(machines.values()),
-        total_hours=total_hours,
-        configs=machine_configs,
+        machines=rows,
+        kpis=kpis,
+        configs=configs,
+        profile_names=profile_names(),
         token=token,
-        jobs_count=len(jobs),
+        version=version,
+        machine_rows_template=MACHINE_ROWS_TEMPLATE,
     )
 
 @app.route("/")
 def home():
     return "GreenIdle server OK"
 
+load_state()
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=DEBUG)
@@ -0,0 +1,452 @@
+# greenidle_store.py
+# =========================================================
+# Stockage de la "MINI BDD" de greenidle_server.
+# - MemoryStore : comportement historique (tout en mémoire, rien n'est persisté)
+# - SQLiteStore : SQLite en mode WAL, tables indexées, écriture différée
+#   (write-behind) : les objets modifiés sont bufferisés puis écrits par lots,
+#   donc /report ne paie pas un commit (ni un fsync) par requête.
+# - SharedSQLiteStore : la base est la source de vérité partagée entre
+#   workers gunicorn ; chaque mutation passe par transaction().
+# Sous un worker gevent (monkey patch fait avant l'import), les requêtes SQLite
+# tournent dans le pool de threads natifs de gevent : une attente de verrou
+# (BEGIN IMMEDIATE, busy_timeout) ou un checkpoint ne bloque pas le hub.
+# =========================================================
+
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+log = logging.getLogger("greenidle.store")
+
+# table -> (clé primaire, colonnes indexées extraites de l'objet)
+KEYED_TABLES = {
+    "machines": ("machine_id", ()),
+    "machine_configs": ("machine_id", ()),
+    "jobs": ("job_id", ("status",)),
+    "tasks": ("task_id", ("job_id", "status")),
+    "clients": ("client_id", ()),
+    "machine_to_client": ("machine_id", ()),
+    "config_profiles": ("name", ()),
+}
+
+# tables append-only -> colonnes indexées
+LOG_TABLES = {
+    "results": ("job_id", "task_id", "machine_id"),
+    "tasks_log": ("task_id", "machine_id"),
+}
+
+INDEXES = tuple(
+    f"CREATE INDEX IF NOT EXISTS {t}_rev ON {t}(rev)" for t in KEYED_TABLES
+) + (
+    "CREATE INDEX IF NOT EXISTS tasks_job_status ON tasks(job_id, status)",
+    "CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status)",
+    "CREATE INDEX IF NOT EXISTS results_job ON results(job_id)",
+    "CREATE INDEX IF NOT EXISTS tasks_log_task ON tasks_log(task_id)",
+)
+
+
+def gevent_patched() -> bool:
+    """True when gevent has monkey-patched threading (locks are then cooperative)."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+class _OffloadedConnection:
+    """
+    sqlite3 connection whose execute()/executemany() run in gevent's native
+    thread pool. Only used when threading was patched before the store was
+    built: its locks are then cooperative, so a greenlet waiting for the pool
+    never holds a native lock another greenlet could block on. Row fetching
+    after execute() stays in the calling greenlet (no lock wait there).
+    """
+
+    def __init__(self, conn):
+        import gevent
+        self._conn = conn
+        self._hub = gevent.get_hub
+
+    def execute(self, *args):
+        return self._hub().threadpool.apply(self._conn.execute, args)
+
+    def executemany(self, *args):
+        return self._hub().threadpool.apply(self._conn.executemany, args)
+
+    def close(self):
+        self._conn.close()
+
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"), default=str)
+
+
+def _col(obj, name):
+    return obj.get(name) if isinstance(obj, dict) else None
+
+
+# lignes de log insérées entre deux purges des tables append-only
+LOG_PRUNE_EVERY = 1000
+
+
+class MemoryStore:
+    """Historical behaviour: nothing survives a restart."""
+
+    durable = False
+    shared = False
+
+    def load(self, log_limit: int = None) -> dict:
+        return {}
+
+    def put(self, table: str, key, obj):
+        pass
+
+    def append(self, table: str, obj):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def worker_id(self) -> int:
+        return 0
+
+
+class SQLiteStore(MemoryStore):
+    """
+    SQLite (WAL) backend with a write-behind buffer.
+
+    put() only remembers a reference to the live object; it is serialized at
+    flush time, so several updates of the same row between two flushes cost
+    a single write. `lock` is the server state lock: it is held while the
+    buffer is snapshotted so objects are not serialized mid-update.
+    A crash loses at most `flush_interval` seconds of updates.
+    The append-only log tables keep their last `log_retention[table]` rows;
+    older ones are deleted every LOG_PRUNE_EVERY inserts.
+    """
+
+    durable = True
+
+    def __init__(self, path: str, lock=None, flush_interval: float = 1.0, max_buffer: int = 2000,
+                 log_retention: dict = None):
+        self.path = path
+        self.lock = lock or threading.RLock()
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.log_retention = dict(log_retention or {})
+        self._log_inserted = {t: 0 for t in LOG_TABLES}  # insertions depuis la dernière purge
+
+        self._db_lock = threading.RLock()  # réentrant : worker_id() / flush() sous transaction()
+        self._flush_lock = threading.Lock()  # snapshot + écriture dans l'ordre
+        self._wake = threading.Event()
+        self._dirty = {}    # (table, key) -> objet vivant
+        self._appends = []  # [(table, objet)]
+
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if gevent_patched():
+            self.db = _OffloadedConnection(self.db)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # WAL: pas de fsync par commit
+        self.db.execute("PRAGMA busy_timeout=5000")
+        self._create_schema()
+
+        # dernière révision / dernier id de log déjà présents en mémoire
+        self.rev = 0
+        self.log_ids = {t: 0 for t in LOG_TABLES}
+
+        self._stop = threading.Event()
+        if flush_interval > 0:
+            threading.Thread(target=self._flush_loop, name="store-flush", daemon=True).start()
+        atexit.register(self.close)
+
+    def _create_schema(self):
+        # meta.rev : compteur global incrémenté à chaque écriture par lot ;
+        # chaque ligne porte la révision qui l'a écrite (sync entre workers)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v INTEGER NOT NULL)")
+        self.db.execute("INSERT OR IGNORE INTO meta (k, v) VALUES ('rev', 0)")
+        self.db.execute("INSERT OR IGNORE INTO meta (k, v) VALUES ('workers', 0)")
+        for table, (pk, cols) in KEYED_TABLES.items():
+            extra = "".join(f", {c} TEXT" for c in cols)
+            self.db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ({pk} TEXT PRIMARY KEY{extra}, "
+                f"rev INTEGER NOT NULL DEFAULT 0, data TEXT NOT NULL)"
+            )
+            known = {r[1] for r in self.db.execute(f"PRAGMA table_info({table})")}
+            if "rev" not in known:  # base créée avant l'ajout de rev
+                self.db.execute(f"ALTER TABLE {table} ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+        for table, cols in LOG_TABLES.items():
+            extra = "".join(f", {c} TEXT" for c in cols)
+            self.db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY AUTOINCREMENT{extra}, data TEXT NOT NULL)"
+            )
+        for sql in INDEXES:
+            self.db.execute(sql)
+
+    # ---------- lecture (démarrage)
+    def load(self, log_limit: int = None) -> dict:
+        """
+        Returns {table: {key: obj}} for keyed tables and {table: [obj]} for logs
+        (only the last `log_limit` rows of each log when given).
+        """
+        out = {}
+        with self._db_lock:
+            self.db.execute("BEGIN")  # instantané cohérent (WAL)
+            try:
+                self.rev = self._meta_rev()
+                for table, (pk, _cols) in KEYED_TABLES.items():
+                    rows = self.db.execute(f"SELECT {pk}, data FROM {table} ORDER BY rowid")
+                    out[table] = {k: json.loads(d) for k, d in rows}
+                for table in LOG_TABLES:
+                    out[table] = []
+                    sql = f"SELECT id, data FROM {table} ORDER BY id"
+                    if log_limit is not None:
+                        sql = f"SELECT id, data FROM ({sql} DESC LIMIT {int(log_limit)}) ORDER BY id"
+                    for i, d in self.db.execute(sql):
+                        out[table].append(json.loads(d))
+                        self.log_ids[table] = i
+            finally:
+                self.db.execute("COMMIT")
+        return out
+
+    def _meta_rev(self) -> int:
+        return self.db.execute("SELECT v FROM meta WHERE k = 'rev'").fetchone()[0]
+
+    def worker_id(self) -> int:
+        """
+        Number unique to this process among those that opened the database
+        (suffix of its log seqs). Call it outside transaction().
+        """
+        with self._db_lock:
+            return self.db.execute("UPDATE meta SET v = v + 1 WHERE k = 'workers' RETURNING v").fetchone()[0]
+
+    # ---------- écriture différée
+    def put(self, table: str, key, obj):
+        with self.lock:
+            self._dirty[(table, key)] = obj
+            if len(self._dirty) + len(self._appends) >= self.max_buffer:
+                self._wake.set()
+
+    def append(self, table: str, obj):
+        with self.lock:
+            self._appends.append((table, obj))
+            if len(self._dirty) + len(self._appends) >= self.max_buffer:
+                self._wake.set()
+
+    def _snapshot(self):
+        """
+        Takes the buffer and serializes it. Returns (upserts, inserts, batch);
+        pass `batch` to _restore() if the write fails.
+        """
+        with self.lock:
+            dirty, self._dirty = self._dirty, {}
+            appends, self._appends = self._appends, []
+            upserts = {}
+            for (table, key), obj in dirty.items():
+                _pk, cols = KEYED_TABLES[table]
+                upserts.setdefault(table, []).append(
+                    (str(key),) + tuple(_col(obj, c) for c in cols) + (_dumps(obj),)
+                )
+            inserts = {}
+            for table, obj in appends:
+                cols = LOG_TABLES[table]
+                inserts.setdefault(table, []).append(
+                    tuple(_col(obj, c) for c in cols) + (_dumps(obj),)
+                )
+        return upserts, inserts, (dirty, appends)
+
+    def _restore(self, batch):
+        """Puts a batch whose write failed back in front of the buffer (newer puts win)."""
+        dirty, appends = batch
+        with self.lock:
+            for k, obj in dirty.items():
+                self._dirty.setdefault(k, obj)
+            self._appends[:0] = appends
+
+    def _write_rows(self, upserts: dict, inserts: dict):
+        """Writes one batch inside the caller's transaction, stamped with a new rev."""
+        rev = self.db.execute("UPDATE meta SET v = v + 1 WHERE k = 'rev' RETURNING v").fetchone()[0]
+        for table, rows in upserts.items():
+            pk, cols = KEYED_TABLES[table]
+            names = (pk,) + cols + ("rev", "data")
+            updates = ", ".join(f"{c}=excluded.{c}" for c in cols + ("rev", "data"))
+            self.db.executemany(
+                f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+                f"ON CONFLICT({pk}) DO UPDATE SET {updates}",
+                [r[:-1] + (rev, r[-1]) for r in rows],
+            )
+        for table, rows in inserts.items():
+            names = LOG_TABLES[table] + ("data",)
+            self.db.executemany(
+                f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                rows,
+            )
+            self._prune_log(table, len(rows))
+        return rev
+
+    def _prune_log(self, table: str, inserted: int):
+        # id croissant : garder les `keep` derniers = une suppression par plage sur la clé primaire
+        keep = self.log_retention.get(table)
+        self._log_inserted[table] += inserted
+        if not keep or self._log_inserted[table] < LOG_PRUNE_EVERY:
+            return
+        self._log_inserted[table] = 0
+        self.db.execute(f"DELETE FROM {table} WHERE id <= (SELECT MAX(id) FROM {table}) - ?", (int(keep),))
+
+    def _write(self, upserts: dict, inserts: dict):
+        if not upserts and not inserts:
+            return
+        with self._db_lock:
+            self.db.execute("BEGIN")
+            try:
+                self._write_rows(upserts, inserts)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def flush(self):
+        """
+        Writes the buffer now. Must not be called while holding `lock`.
+        On failure the batch goes back into the buffer and the error is raised.
+        """
+        with self._flush_lock:
+            upserts, inserts, batch = self._snapshot()
+            try:
+                self._write(upserts, inserts)
+            except Exception:
+                self._restore(batch)
+                raise
+
+    def _flush_loop(self):
+        # réveillé par l'intervalle ou dès que le buffer est plein ; une erreur
+        # (base verrouillée, disque plein...) laisse le lot en buffer pour le tour suivant
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception("flush SQLite échoué, nouvel essai dans %ss", self.flush_interval)
+
+    def close(self):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._wake.set()
+        try:
+            self.flush()
+        finally:
+            with self._db_lock:
+                self.db.close()
+
+
+class SharedSQLiteStore(SQLiteStore):
+    """
+    Multi-process backend: the SQLite file is the source of truth shared by
+    every gunicorn worker, and each worker's dicts are a cache of it.
+
+    Every read-modify-write runs inside transaction(): BEGIN IMMEDIATE takes
+    the database write lock, rows newer than the worker's last rev are merged
+    into its cache (on_changes), the caller mutates, and the buffered rows
+    are written with a fresh rev before COMMIT. Dispatch therefore always
+    sees the latest state and a task is handed out exactly once across
+    workers. Nothing is buffered between requests (no write-behind).
+    Writes are therefore serialized across workers; requests that end up
+    not writing (the server answers them from the synced cache) should not
+    enter transaction().
+    """
+
+    shared = True
+
+    def __init__(self, path: str, lock=None, log_retention: dict = None):
+        super().__init__(path, lock=lock, flush_interval=0, log_retention=log_retention)
+
+    def _changes(self):
+        """Rows written by other workers since the last sync, or None."""
+        cur = self._meta_rev()
+        if cur == self.rev:
+            return None
+        out = {}
+        for table, (pk, _cols) in KEYED_TABLES.items():
+            rows = self.db.execute(
+                f"SELECT {pk}, data FROM {table} WHERE rev > ? ORDER BY rev, rowid", (self.rev,)
+            )
+            out[table] = {k: json.loads(d) for k, d in rows}
+        for table in LOG_TABLES:
+            out[table] = []
+            for i, d in self.db.execute(f"SELECT id, data FROM {table} WHERE id > ? ORDER BY id", (self.log_ids[table],)):
+                out[table].append(json.loads(d))
+                self.log_ids[table] = i
+        self.rev = cur
+        return out
+
+    def changes(self):
+        """Read-only sync (no write lock), for requests that do not mutate."""
+        with self._db_lock:
+            self.db.execute("BEGIN")
+            try:
+                return self._changes()
+            finally:
+                self.db.execute("COMMIT")
+
+    @contextmanager
+    def transaction(self, on_changes):
+        """
+        Cross-process critical section. The caller must hold `lock` so the
+        buffer only contains this transaction's writes.
+        """
+        with self._db_lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                ch = self._changes()
+                if ch:
+                    on_changes(ch)
+                yield
+            finally:
+                # les dicts sont déjà modifiés : on écrit même si le handler a levé
+                upserts, inserts, batch = self._snapshot()
+                try:
+                    if upserts or inserts:
+                        self.rev = self._write_rows(upserts, inserts)
+                        for table in inserts:
+                            self.log_ids[table] = self.db.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0]
+                    self.db.execute("COMMIT")
+                except Exception:
+                    self.db.execute("ROLLBACK")
+                    self._restore(batch)  # réécrit par la prochaine transaction
+                    raise
+
+    def flush(self):
+        # normalement vide hors transaction ; écrit sans toucher à self.rev
+        # (ces lignes seront simplement relues au prochain sync)
+        with self.lock, self._db_lock:
+            upserts, inserts, batch = self._snapshot()
+            if not upserts and not inserts:
+                return
+            try:
+                self.db.execute("BEGIN IMMEDIATE")
+                try:
+                    self._write_rows(upserts, inserts)
+                    self.db.execute("COMMIT")
+                except Exception:
+                    self.db.execute("ROLLBACK")
+                    raise
+            except Exception:
+                self._restore(batch)
+                raise
+
+
+def open_store(path: str, lock=None, flush_interval: float = 1.0, shared: bool = False,
+               log_retention: dict = None) -> MemoryStore:
+    """SQLite store when `path` is set, else the historical in-memory behaviour."""
+    if not path:
+        return MemoryStore()
+    if shared:
+        return SharedSQLiteStore(path, lock=lock, log_retention=log_retention)
+    return SQLiteStore(path, lock=lock, flush_interval=flush_interval, log_retention=log_retention)
@@ -0,0 +1,133 @@
+# loadtest.py
+# =========================================================
+# Banc de charge multi-workers pour greenidle_server.
+# Lance gunicorn avec le store SQLite partagé (GREENIDLE_SHARED=1) pour
+# chaque nombre de workers demandé, fait tourner des machines simulées
+# (/task puis /report en boucle) et affiche le débit de tâches par seconde.
+# Vérifie aussi qu'aucune tâche n'est distribuée deux fois.
+#
+#   python loadtest.py --workers 1,2,4 --clients 16 --duration 10
+# =========================================================
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "loadtest"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(port: int, timeout: float = 15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("gunicorn ne répond pas")
+
+
+def _submit_jobs(port: int, total_tasks: int):
+    # les machines ne reçoivent que les types de leurs plugins_required : "hello" via le profil par défaut
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    conn.request("POST", f"/profiles/default?token={TOKEN}",
+                 body=json.dumps({"plugins_required": ["hello"]}), headers={"Content-Type": "application/json"})
+    conn.getresponse().read()
+    # /submit plafonne à 500 chunks par job : on crée autant de jobs que nécessaire
+    left = total_tasks
+    while left > 0:
+        n = min(500, left)
+        body = urllib.parse.urlencode({"name": "loadtest", "task_type": "hello", "chunks": n})
+        conn.request("POST", f"/submit?token={TOKEN}", body=body,
+                     headers={"Content-Type": "application/x-www-form-urlencoded"})
+        conn.getresponse().read()
+        left -= n
+    conn.close()
+
+
+def _client(args):
+    port, machine_id, duration = args
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    got = []
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        conn.request("GET", f"/task?machine_id={machine_id}")
+        resp = conn.getresponse()
+        data = resp.read()
+        if resp.status == 204:
+            break
+        task = json.loads(data)
+        got.append(task["task_id"])
+        body = json.dumps({"machine_id": machine_id, "task_id": task["task_id"],
+                           "seconds": 0, "result": {"ok": True}})
+        conn.request("POST", "/report", body=body, headers={"Content-Type": "application/json"})
+        conn.getresponse().read()
+    return got
+
+
+def run_once(workers: int, clients: int, duration: float, total_tasks: int) -> dict:
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   ADMIN_TOKEN=TOKEN,
+                   GREENIDLE_DB=os.path.join(tmp, "greenidle.db"),
+                   GREENIDLE_SHARED="1",
+                   RATE_LIMIT_ENABLED="0")
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}",
+             "--log-level", "warning", "greenidle_server:app"],
+            cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL,
+        )
+        try:
+            _wait_ready(port)
+            _submit_jobs(port, total_tasks)
+            start = time.time()
+            with multiprocessing.Pool(clients) as pool:
+                per_client = pool.map(_client, [(port, f"lt-{i}", duration) for i in range(clients)])
+            elapsed = time.time() - start
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    all_ids = [tid for ids in per_client for tid in ids]
+    return {
+        "workers": workers,
+        "tasks": len(all_ids),
+        "tasks_per_s": len(all_ids) / elapsed if elapsed > 0 else 0.0,
+        "duplicates": len(all_ids) - len(set(all_ids)),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Banc de charge multi-workers GreenIdle")
+    ap.add_argument("--workers", default="1,2,4", help="nombres de workers gunicorn, ex: 1,2,4")
+    ap.add_argument("--clients", type=int, default=16, help="machines simulées (processus)")
+    ap.add_argument("--duration", type=float, default=10.0, help="secondes par palier")
+    ap.add_argument("--tasks", type=int, default=100000, help="tâches créées par palier")
+    args = ap.parse_args()
+
+    print(f"{'workers':>8} {'tâches':>8} {'tâches/s':>10} {'doublons':>9}")
+    for w in [int(x) for x in args.workers.split(",") if x.strip()]:
+        r = run_once(w, args.clients, args.duration, args.tasks)
+        print(f"{r['workers']:>8} {r['tasks']:>8} {r['tasks_per_s']:>10.1f} {r['duplicates']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+# loadtest_idle.py
+# =========================================================
+# Banc "machines connectées" pour greenidle_server : combien de machines
+# inactives un seul worker gunicorn (1 coeur) tient, en mode sync puis gevent.
+# Chaque machine simulée boucle sur POST /poll (heartbeat + config + tâche) :
+# - gevent : la requête est tenue jusqu'à --wait secondes (long-poll) ;
+# - sync   : /poll répond tout de suite, la machine dort --idle-sleep secondes.
+# Pendant ce temps une sonde mesure la latence d'un /heartbeat ; un palier est
+# "tenu" s'il n'y a aucune erreur et que le p99 reste sous --max-latency.
+# Les machines tournent dans des sous-processus gevent (--per-proc chacun).
+#
+#   python loadtest_idle.py --modes sync,gevent --machines 500,1000,2000,4000
+# =========================================================
+
+import argparse
+import http.client
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from loadtest import BASE_DIR, TOKEN, _free_port, _wait_ready
+
+
+def _raise_nofile(n: int):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    want = min(hard, max(soft, n))
+    if want > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (want, hard))
+
+
+# ---------- sous-processus client (gevent)
+def client_main(port: int, first: int, count: int, duration: float, wait: float, idle_sleep: float, ramp: float):
+    from gevent import monkey
+    monkey.patch_all()
+    import gevent
+
+    _raise_nofile(count + 64)
+    stats = {"polls": 0, "tasks": 0, "errors": 0}
+    deadline = time.time() + duration
+
+    def machine(machine_id: str):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=wait + 30)
+        version = None
+        reused = False
+        while time.time() < deadline:
+            body = json.dumps({"machine_id": machine_id, "cpu_percent": 0,
+                               "config_version": version, "wait": wait})
+            t0 = time.time()
+            try:
+                conn.request("POST", "/poll", body=body, headers={"Content-Type": "application/json"})
+                resp = conn.getresponse()
+                data = json.loads(resp.read())
+            except (OSError, http.client.HTTPException, ValueError):
+                conn.close()
+                if reused:
+                    # keep-alive fermé par le serveur pendant la pause : on rouvre
+                    reused = False
+                    continue
+                stats["errors"] += 1
+                gevent.sleep(1)
+                continue
+            reused = True
+            stats["polls"] += 1
+            version = data.get("config_version", version)
+            task = data.get("task")
+            if task:
+                stats["tasks"] += 1
+                report = json.dumps({"machine_id": machine_id, "task_id": task["task_id"],
+                                     "seconds": 0, "result": {"ok": True}})
+                try:
+                    conn.request("POST", "/report", body=report, headers={"Content-Type": "application/json"})
+                    conn.getresponse().read()
+                except (OSError, http.client.HTTPException):
+                    stats["errors"] += 1
+                    conn.close()
+            elif "config" not in data and time.time() - t0 < wait / 2:
+                # pas de long-poll côté serveur : comportement historique du client
+                gevent.sleep(idle_sleep)
+
+    # démarrage étalé sur `ramp` secondes pour ne pas tout connecter au même instant
+    greenlets = []
+    for i in range(count):
+        greenlets.append(gevent.spawn_later(ramp * i / max(1, count), machine, f"idle-{first + i}"))
+    gevent.joinall(greenlets)
+    print(json.dumps(stats))
+
+
+# ---------- orchestration
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _probe(port: int, duration: float, timeout: float) -> dict:
+    lat, failures = [], 0
+    deadline = time.time() + duration
+    body = json.dumps({"machine_id": "probe", "cpu_percent": 0})
+    while time.time() < deadline:
+        t0 = time.time()
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+            conn.request("POST", "/heartbeat", body=body, headers={"Content-Type": "application/json"})
+            conn.getresponse().read()
+            conn.close()
+            lat.append(time.time() - t0)
+        except (OSError, http.client.HTTPException):
+            failures += 1
+        time.sleep(0.2)
+    return {"p50": _percentile(lat, 0.5), "p99": _percentile(lat, 0.99), "failures": failures}
+
+
+def run_once(mode: str, machines: int, args) -> dict:
+    port = _free_port()
+    _raise_nofile(machines + 256)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   ADMIN_TOKEN=TOKEN,
+                   GREENIDLE_DB=os.path.join(tmp, "greenidle.db"),
+                   LOG_SPILL_DIR="",
+                   RATE_LIMIT_ENABLED="0",
+                   POLL_MAX_WAIT=str(args.wait))
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-w", "1", "-k", mode,
+             "--worker-connections", str(machines + 256), "--backlog", "4096",
+             "-b", f"127.0.0.1:{port}", "--timeout", str(int(args.wait + 60)),
+             "--log-level", "critical", "greenidle_server:app"],
+            cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        clients = []
+        try:
+            _wait_ready(port)
+            for first in range(0, machines, args.per_proc):
+                count = min(args.per_proc, machines - first)
+                clients.append(subprocess.Popen(
+                    [sys.executable, __file__, "--client", str(port), str(first), str(count),
+                     str(args.duration), str(args.wait), str(args.idle_sleep), str(args.ramp)],
+                    cwd=BASE_DIR, stdout=subprocess.PIPE, text=True,
+                ))
+            # la sonde ne mesure que le régime établi (montée en charge + premiers polls passés)
+            settle = args.ramp + 2
+            time.sleep(settle)
+            start = time.time()
+            probe = _probe(port, args.duration - settle, args.max_latency * 10)
+            stats = {"polls": 0, "tasks": 0, "errors": 0}
+            for c in clients:
+                out, _ = c.communicate(timeout=args.wait + 90)
+                for k, v in json.loads(out.strip().splitlines()[-1] or "{}").items():
+                    stats[k] += v
+            elapsed = time.time() - start + settle
+        finally:
+            for c in clients:
+                if c.poll() is None:
+                    c.kill()
+            proc.terminate()
+            proc.wait()
+
+    return {
+        "mode": mode,
+        "machines": machines,
+        "polls_per_s": stats["polls"] / elapsed if elapsed > 0 else 0.0,
+        "errors": stats["errors"] + probe["failures"],
+        "p50": probe["p50"],
+        "p99": probe["p99"],
+        "ok": stats["errors"] + probe["failures"] == 0 and probe["p99"] <= args.max_latency,
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--client":
+        port, first, count, duration, wait, idle_sleep, ramp = sys.argv[2:9]
+        client_main(int(port), int(first), int(count), float(duration), float(wait), float(idle_sleep), float(ramp))
+        return
+
+    ap = argparse.ArgumentParser(description="Banc machines connectées GreenIdle (sync vs gevent)")
+    ap.add_argument("--modes", default="sync,gevent", help="classes de worker gunicorn, ex: sync,gevent")
+    ap.add_argument("--machines", default="500,1000,2000,4000", help="paliers de machines simulées")
+    ap.add_argument("--duration", type=float, default=30.0, help="secondes par palier")
+    ap.add_argument("--ramp", type=float, default=5.0, help="secondes de montée en charge (hors mesure)")
+    ap.add_argument("--wait", type=float, default=25.0, help="attente long-poll demandée à /poll")
+    ap.add_argument("--idle-sleep", type=float, default=2.0, help="pause client sans long-poll (idle_sleep_seconds)")
+    ap.add_argument("--per-proc", type=int, default=1000, help="machines par sous-processus client")
+    ap.add_argument("--max-latency", type=float, default=1.0, help="p99 max de la sonde pour tenir un palier")
+    args = ap.parse_args()
+
+    print(f"{'mode':>7} {'machines':>9} {'polls/s':>9} {'p50 (s)':>8} {'p99 (s)':>8} {'erreurs':>8} {'tenu':>5}")
+    best = {}
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        for n in [int(x) for x in args.machines.split(",") if x.strip()]:
+            r = run_once(mode, n, args)
+            print(f"{r['mode']:>7} {r['machines']:>9} {r['polls_per_s']:>9.1f} {r['p50']:>8.3f} "
+                  f"{r['p99']:>8.3f} {r['errors']:>8} {'oui' if r['ok'] else 'non':>5}")
+            if r["ok"]:
+                best[mode] = max(best.get(mode, 0), n)
+    for mode, n in best.items():
+        print(f"{mode}: {n} machines tenues par un worker")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,112 @@
+import os
 import random
 import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:  # la machine n'a pas numpy : boucle pure Python
+    np = None
+
+# Taille d'un bloc de tirages NumPy : 2 buffers float64 de 8 Mo,
+# mémoire bornée quel que soit n.
+BLOCK_SIZE = 1 << 20
+
+# Le tirage est découpé en sous-flux d'environ STREAM_SIZE tirages, chacun
+# avec sa graine dérivée de (seed, rang) : leur nombre ne dépend que de n,
+# donc le résultat pour une seed donnée est le même quel que soit "workers"
+# ou la machine. "workers" ne décide que de la répartition des sous-flux.
+# C'est aussi le grain minimal utile par processus (démarrage du pool).
+STREAM_SIZE = 1 << 20
+
+
+def _count_inside_numpy(n: int, seed) -> int:
+    # seed: None (entropie du système), entier ou SeedSequence
+    rng = np.random.default_rng(seed)
+    x = np.empty(min(n, BLOCK_SIZE))
+    y = np.empty_like(x)
+    inside = 0
+    left = n
+    while left > 0:
+        m = min(left, BLOCK_SIZE)
+        bx, by = x[:m], y[:m]
+        rng.random(out=bx)
+        rng.random(out=by)
+        np.multiply(bx, bx, out=bx)
+        np.multiply(by, by, out=by)
+        np.add(bx, by, out=bx)
+        inside += int(np.count_nonzero(bx <= 1.0))
+        left -= m
+    return inside
+
+
+def _count_inside_python(n: int, seed) -> int:
+    rng = random.Random(seed)
+    inside = 0
+    for _ in range(n):
+        x = rng.random()
+        y = rng.random()
+        if x*x + y*y <= 1.0:
+            inside += 1
+    return inside
+
+
+def _count_inside(n: int, seed) -> int:
+    if np is not None:
+        return _count_inside_numpy(n, seed)
+    return _count_inside_python(n, seed)
+
+
+def _streams(n: int, seed):
+    """(sizes, seeds) of the sub-streams, derived from n and seed only."""
+    k = max(1, -(-n // STREAM_SIZE))
+    base, rem = divmod(n, k)
+    sizes = [base + 1 if i < rem else base for i in range(k)]
+    if k == 1:
+        return sizes, [seed]  # un seul flux : même résultat qu'avant le découpage
+    if np is not None:
+        return sizes, np.random.SeedSequence(seed).spawn(k)
+    if seed is None:
+        return sizes, [None] * k
+    return sizes, [f"{seed}:{i}" for i in range(k)]
+
+
+def _count_inside_parallel(sizes: list, seeds: list, workers: int) -> int:
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return sum(ex.map(_count_inside, sizes, seeds))
+
 
 def run(payload: dict) -> dict:
     n = int(payload.get("n", 200_000))
     seed = payload.get("seed")
     if seed is not None:
-        random.seed(int(seed))
+        seed = int(seed) & 0xFFFFFFFFFFFFFFFF
+
+    sizes, seeds = _streams(n, seed)
+
+    # "workers" (job ou plugin_workers de la machine), borné par les coeurs et par les sous-flux
+    workers = int(payload.get("workers", 1) or 1)
+    workers = max(1, min(workers, os.cpu_count() or 1, len(sizes)))
 
     start = time.time()
-    inside = 0
 
-    for _ in range(n):
-        x = random.random()
-        y = random.random()
-        if x*x + y*y <= 1.0:
-            inside += 1
+    inside = None
+    if workers > 1:
+        try:
+            inside = _count_inside_parallel(sizes, seeds, workers)
+        except Exception:
+            # pool indisponible (plateforme, pickling, sandbox...) : on repasse en série
+            workers = 1
+    if inside is None:
+        inside = sum(map(_count_inside, sizes, seeds))
 
     elapsed = time.time() - start
-    pi_estimate = 4.0 * inside / float(n)
+    pi_estimate = 4.0 * inside / float(n) if n > 0 else 0.0
 
     return {
         "inside": inside,
         "total": n,
         "pi_estimate": pi_estimate,
+        "workers": workers,
         "seconds": max(1, int(elapsed))
     }
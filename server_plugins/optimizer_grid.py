@@ -3,13 +3,29 @@
 # GreenIdle plugin: optimizer_grid
 # - mode 1: "params" (évalue une seule combinaison)
 # - mode 2: "grid" + "chunk_index/chunk_count" (évalue une tranche de la grille)
-# Retourne le meilleur candidat trouvé + stats.
+# Retourne le meilleur candidat trouvé, le top-k de la tranche + stats.
+# Le scoring de tranche est vectorisé avec NumPy (score_batch) quand il est installé.
 # =========================================================
 
+import os
 import time
+import heapq
 import random
-import itertools
 from typing import Dict, Any, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:  # pas de numpy : scoring dict par dict
+    np = None
+
+# Axes lus par score_function / score_batch (les autres clés n'influent pas sur le score)
+SCORED_KEYS = ("alpha", "beta", "gamma")
+# Combinaisons scorées par bloc NumPy : mémoire bornée quelle que soit la tranche
+SCORE_BLOCK = 1 << 18
+TOP_K_DEFAULT = 10
+# Mode parallèle ("workers" > 1) : tranche minimale par sous-processus
+PARALLEL_MIN_PER_WORKER = 1 << 20
 
 
 def score_function(params: dict, metric: str) -> float:
@@ -32,6 +48,25 @@ def score_function(params: dict, metric: str) -> float:
     return loss
 
 
+def score_batch(axes: Dict[str, Any], metric: str):
+    """
+    Version vectorisée de score_function.
+    axes: {"alpha": array, "beta": array, "gamma": array}, soit alignés
+    (une combinaison par élément, ex. une tranche à plat), soit diffusables
+    (maillage complet, ex. np.ix_(alphas, betas, gammas)).
+    Retourne le tableau des scores, mêmes valeurs que score_function.
+    """
+    a = np.asarray(axes.get("alpha", 0), dtype=float)
+    b = np.asarray(axes.get("beta", 0), dtype=float)
+    g = np.asarray(axes.get("gamma", 0), dtype=float)
+
+    loss = (a - 0.3) ** 2 + (b - 2) ** 2 + (g - 15) ** 2
+
+    if metric == "maximize_score":
+        return -loss
+    return loss
+
+
 def _as_list(v) -> List[Any]:
     if v is None:
         return []
@@ -43,26 +78,124 @@ def _as_list(v) -> List[Any]:
     return [v]
 
 
-def _make_grid_combos(grid: dict) -> List[dict]:
+def _grid_axes(grid: dict) -> Tuple[List[str], List[List[Any]]]:
     """
-    Convertit:
-      {"alpha":[...], "beta":[...], "gamma":[...]}
-    en liste de dicts params [{alpha:..., beta:..., gamma:...}, ...]
-    Ordre stable (alpha->beta->gamma).
+    Retourne (keys, values_lists) de la grille, ou ([], []) si invalide.
     """
     if not isinstance(grid, dict) or not grid:
-        return []
+        return [], []
 
     keys = list(grid.keys())
     values_lists = [_as_list(grid.get(k)) for k in keys]
 
     if any(len(vs) == 0 for vs in values_lists):
-        return []
+        return [], []
+    return keys, values_lists
+
+
+def _iter_grid_slice(keys: List[str], values_lists: List[List[Any]], start: int, end: int):
+    """
+    Génère les combinaisons d'indices [start, end) sans construire la grille.
+    Même ordre que itertools.product : la dernière clé varie le plus vite.
+    On décode start en base mixte puis on incrémente comme un compteur.
+    """
+    if end <= start:
+        return
+    radices = [len(vs) for vs in values_lists]
+
+    digits = [0] * len(radices)
+    index = start
+    for pos in range(len(radices) - 1, -1, -1):
+        index, digits[pos] = divmod(index, radices[pos])
+
+    for _ in range(end - start):
+        yield {k: values_lists[i][digits[i]] for i, k in enumerate(keys)}
+        pos = len(radices) - 1
+        while pos >= 0:
+            digits[pos] += 1
+            if digits[pos] < radices[pos]:
+                break
+            digits[pos] = 0
+            pos -= 1
+
+
+def _grid_params(keys: List[str], values_lists: List[List[Any]], index: int) -> dict:
+    return next(_iter_grid_slice(keys, values_lists, index, index + 1))
+
 
-    combos = []
-    for vals in itertools.product(*values_lists):
-        combos.append({k: vals[i] for i, k in enumerate(keys)})
-    return combos
+def _top_in_slice_numpy(keys, values_lists, start, end, metric, top_k) -> List[Tuple[int, float]]:
+    """
+    Scoring vectorisé de [start, end) par blocs de SCORE_BLOCK.
+    Retourne [(index, score), ...] des top_k meilleurs, le meilleur en tête
+    (à score égal, le plus petit index, comme la boucle Python).
+    """
+    radices = [len(vs) for vs in values_lists]
+    strides = [1] * len(radices)
+    for pos in range(len(radices) - 2, -1, -1):
+        strides[pos] = strides[pos + 1] * radices[pos + 1]
+
+    scored = {}
+    for pos, k in enumerate(keys):
+        if k in SCORED_KEYS:
+            scored[k] = (pos, np.array([float(v) for v in values_lists[pos]]))
+
+    best_idx = np.empty(0, dtype=np.int64)
+    best_score = np.empty(0)
+    for lo in range(start, end, SCORE_BLOCK):
+        idx = np.arange(lo, min(end, lo + SCORE_BLOCK), dtype=np.int64)
+        axes = {k: arr[(idx // strides[pos]) % radices[pos]] for k, (pos, arr) in scored.items()}
+        scores = np.broadcast_to(score_batch(axes, metric), idx.shape)
+        order_key = -scores if metric == "maximize_score" else scores
+
+        # on ne garde du bloc que les candidats au top-k avant le tri
+        if idx.size > top_k:
+            keep = order_key <= np.partition(order_key, top_k - 1)[top_k - 1]
+            idx, scores = idx[keep], scores[keep]
+
+        idx = np.concatenate([best_idx, idx])
+        scores = np.concatenate([best_score, scores])
+        order = np.lexsort((idx, -scores if metric == "maximize_score" else scores))[:top_k]
+        best_idx, best_score = idx[order], scores[order]
+
+    return [(int(i), float(v)) for i, v in zip(best_idx, best_score)]
+
+
+def _top_in_slice_python(keys, values_lists, start, end, metric, top_k) -> List[Tuple[int, float]]:
+    sign = -1.0 if metric == "maximize_score" else 1.0
+    scored = (
+        (sign * s, start + j, s)
+        for j, s in enumerate(float(score_function(p, metric))
+                              for p in _iter_grid_slice(keys, values_lists, start, end))
+    )
+    return [(i, s) for _, i, s in heapq.nsmallest(top_k, scored)]
+
+
+def top_in_slice(keys, values_lists, start, end, metric, top_k=TOP_K_DEFAULT) -> List[Tuple[int, float]]:
+    """
+    Meilleures combinaisons de la tranche [start, end) : [(index, score), ...].
+    NumPy si disponible, sinon boucle sur score_function.
+    """
+    top_k = max(1, int(top_k))
+    if np is not None and end <= 2 ** 62:
+        return _top_in_slice_numpy(keys, values_lists, start, end, metric, top_k)
+    return _top_in_slice_python(keys, values_lists, start, end, metric, top_k)
+
+
+def _top_in_slice_parallel(keys, values_lists, start, end, metric, top_k, workers) -> List[Tuple[int, float]]:
+    """
+    Découpe [start, end) en `workers` sous-tranches évaluées dans un
+    ProcessPoolExecutor, puis fusionne localement les top-k.
+    """
+    bounds = [_chunk_slice(end - start, i + 1, workers) for i in range(workers)]
+    n = len(bounds)
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        parts = ex.map(top_in_slice, [keys] * n, [values_lists] * n,
+                       [start + lo for lo, _ in bounds], [start + hi for _, hi in bounds],
+                       [metric] * n, [top_k] * n)
+        merged = [e for part in parts for e in part]
+    sign = -1.0 if metric == "maximize_score" else 1.0
+    merged.sort(key=lambda e: (sign * e[1], e[0]))
+    return merged[:max(1, int(top_k))]
 
 
 def _chunk_slice(n_total: int, chunk_index: int, chunk_count: int) -> Tuple[int, int]:
@@ -121,6 +254,7 @@ def run(payload: dict) -> dict:
             "score": round(float(score), 6),
             "evaluated": 1,
             "seconds": max(1, int(elapsed)),
+            "elapsed": round(elapsed, 6),
         }
 
     # -----------------------------------------------------
@@ -130,36 +264,40 @@ def run(payload: dict) -> dict:
     if not isinstance(grid, dict) or not grid:
         return {"error": "invalid_params_or_grid", "hint": "Provide payload.params or payload.grid", "seconds": 1}
 
-    combos = _make_grid_combos(grid)
-    if not combos:
+    keys, values_lists = _grid_axes(grid)
+    if not keys:
         return {"error": "invalid_grid", "seconds": 1}
 
     chunk_index = int(payload.get("chunk_index", 1))
     chunk_count = int(payload.get("chunk_count", 1))
 
-    total = len(combos)
+    total = 1
+    for vs in values_lists:
+        total *= len(vs)
     start_i, end_i = _chunk_slice(total, chunk_index, chunk_count)
-    subset = combos[start_i:end_i]
-
-    best_params = None
-    best_score = None
 
     # Pour minimisation: best = score le plus petit
     # Pour maximisation: best = score le plus grand (score_function gère déjà le signe si maximize_score)
-    for p in subset:
-        s = float(score_function(p, metric))
-        if best_score is None:
-            best_score = s
-            best_params = p
-        else:
-            if metric == "maximize_score":
-                if s > best_score:
-                    best_score = s
-                    best_params = p
-            else:
-                if s < best_score:
-                    best_score = s
-                    best_params = p
+    # La tranche est décodée depuis les index : mémoire O(bloc), pas O(grille)
+    top_k = int(payload.get("top_k", TOP_K_DEFAULT))
+
+    # "workers" (job ou plugin_workers de la machine), borné par les coeurs et la tranche
+    workers = int(payload.get("workers", 1) or 1)
+    workers = max(1, min(workers, os.cpu_count() or 1, (end_i - start_i) // PARALLEL_MIN_PER_WORKER))
+
+    found = None
+    if workers > 1:
+        try:
+            found = _top_in_slice_parallel(keys, values_lists, start_i, end_i, metric, top_k, workers)
+        except Exception:
+            # pool indisponible (plateforme, pickling, sandbox...) : on repasse en série
+            workers = 1
+    if found is None:
+        found = top_in_slice(keys, values_lists, start_i, end_i, metric, top_k)
+
+    top = [{"params": _grid_params(keys, values_lists, i), "score": round(s, 6)} for i, s in found]
+    best_params = top[0]["params"] if top else None
+    best_score = top[0]["score"] if top else None
 
     elapsed = time.time() - start
 
@@ -169,9 +307,12 @@ def run(payload: dict) -> dict:
         "chunk_index": chunk_index,
         "chunk_count": chunk_count,
         "grid_total": total,
-        "grid_slice": {"start": start_i, "end": end_i, "count": len(subset)},
+        "grid_slice": {"start": start_i, "end": end_i, "count": end_i - start_i},
         "best_params": best_params,
         "best_score": round(float(best_score if best_score is not None else 0.0), 6),
-        "evaluated": len(subset),
+        "top": top,
+        "evaluated": end_i - start_i,
+        "workers": workers,
         "seconds": max(1, int(elapsed)),
+        "elapsed": round(elapsed, 6),
     }
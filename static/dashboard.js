@@ -0,0 +1,189 @@
+// Theme
+const saved = localStorage.getItem("theme") || "dark";
+document.documentElement.dataset.theme = saved;
+const darkToggle = document.getElementById("darkToggle");
+darkToggle.checked = (saved === "dark");
+darkToggle.addEventListener("change", () => {
+  const t = darkToggle.checked ? "dark" : "light";
+  document.documentElement.dataset.theme = t;
+  localStorage.setItem("theme", t);
+});
+
+function timeAgo(iso) {
+  if (!iso) return "—";
+  const t = new Date(iso).getTime();
+  const s = Math.floor((Date.now() - t) / 1000);
+  if (s < 60) return `${s}s`;
+  const m = Math.floor(s/60);
+  if (m < 60) return `${m}min`;
+  const h = Math.floor(m/60);
+  if (h < 24) return `${h}h`;
+  const d = Math.floor(h/24);
+  return `${d}j`;
+}
+
+function computeStatus(lastSeenIso, cpu) {
+  if (!lastSeenIso) return {label:"Offline", cls:"off", age: 999999};
+  const ageSec = (Date.now() - new Date(lastSeenIso).getTime()) / 1000;
+  if (ageSec > 180) return {label:"Offline", cls:"off", age: ageSec};
+  if (Number(cpu) <= 10) return {label:"Idle", cls:"idle", age: ageSec};
+  return {label:"Online", cls:"on", age: ageSec};
+}
+
+function refreshDerived() {
+  const rows = Array.from(document.querySelectorAll("tr.row"));
+  let online = 0, cpuSum = 0, cpuCount = 0;
+
+  rows.forEach(r => {
+    const lastSeen = r.dataset.lastseen;
+    const cpu = Number(r.dataset.cpu || 0);
+    const st = computeStatus(lastSeen, cpu);
+
+    const pill = r.querySelector("[data-pill]");
+    pill.textContent = st.label;
+    pill.classList.remove("on","idle","off");
+    pill.classList.add(st.cls);
+
+    const ago = r.querySelector("[data-ago]");
+    ago.textContent = timeAgo(lastSeen);
+
+    if (st.cls !== "off") online += 1;
+    cpuSum += cpu; cpuCount += 1;
+  });
+
+  document.getElementById("kpiOnline").textContent = online;
+  document.getElementById("kpiCpu").textContent = cpuCount ? (cpuSum/cpuCount).toFixed(1) + "%" : "—";
+}
+
+function toggleCfg(machineId) {
+  const el = document.getElementById("cfg-" + machineId);
+  if (!el) return;
+  el.style.display = (el.style.display === "none") ? "" : "none";
+}
+
+// search + sort (client-side)
+const search = document.getElementById("search");
+const sort = document.getElementById("sort");
+
+function applyFilterSort(){
+  const q = (search.value || "").toLowerCase().trim();
+  const rows = Array.from(document.querySelectorAll("tr.row"));
+
+  rows.forEach(r => {
+    const name = r.dataset.name || "";
+    const id = r.dataset.id || "";
+    const show = !q || name.includes(q) || id.includes(q);
+    r.style.display = show ? "" : "none";
+
+    // cache aussi la ligne config associée (robuste)
+    const cfg = document.getElementById("cfg-" + r.dataset.machine);
+    if (cfg && !show) cfg.style.display = "none";
+  });
+
+  const key = sort.value;
+  const parent = document.getElementById("rows");
+
+  const sortable = rows
+    .filter(r => r.style.display !== "none")
+    .map(r => {
+      const cfg = document.getElementById("cfg-" + r.dataset.machine);
+      return {r, cfg};
+    });
+
+  sortable.sort((a,b) => {
+    if (key === "name") return (a.r.dataset.name||"").localeCompare(b.r.dataset.name||"");
+    if (key === "last_cpu") return Number(a.r.dataset.cpu||0) - Number(b.r.dataset.cpu||0);
+    if (key === "total_seconds") return Number(b.r.dataset.seconds||0) - Number(a.r.dataset.seconds||0);
+    // last_seen desc
+    return new Date(b.r.dataset.lastseen||0).getTime() - new Date(a.r.dataset.lastseen||0).getTime();
+  });
+
+  sortable.forEach(({r,cfg}) => {
+    parent.appendChild(r);
+    if (cfg) parent.appendChild(cfg);
+  });
+}
+
+search.addEventListener("input", applyFilterSort);
+sort.addEventListener("change", applyFilterSort);
+
+refreshDerived();
+applyFilterSort();
+setInterval(refreshDerived, 4000);
+
+// Deltas : /api/dashboard?since=<version> ne renvoie que les machines modifiées.
+// Les lignes connues sont patchées sur place ; les nouvelles machines (ou
+// celles dont le nom / l'état / les plugins ont changé) sont re-rendues par
+// /api/dashboard/rows puis insérées, sans recharger la page.
+const rowsEl = document.getElementById("rows");
+const token = new URLSearchParams(location.search).get("token") || "";
+let dashVersion = rowsEl.dataset.version || "0";  // chaîne : > 2**53, ne pas convertir en Number
+
+function rowOf(machineId) {
+  return rowsEl.querySelector(`tr.row[data-machine="${CSS.escape(machineId)}"]`);
+}
+
+function patchRow(r, m) {
+  r.dataset.lastseen = m.last_seen || "";
+  r.dataset.cpu = m.last_cpu || 0;
+  r.dataset.seconds = m.total_seconds || 0;
+  r.querySelector('[data-f="cpu"]').textContent = `${m.last_cpu}%`;
+  r.querySelector('[data-f="lastseen"]').textContent = m.last_seen || "";
+  r.querySelector('[data-f="seconds"]').textContent = m.total_seconds;
+}
+
+async function replaceRows(ids) {
+  const resp = await fetch(`/api/dashboard/rows?token=${encodeURIComponent(token)}&ids=${ids.map(encodeURIComponent).join(",")}`);
+  if (!resp.ok) return;
+  const tpl = document.createElement("template");
+  tpl.innerHTML = await resp.text();
+  tpl.content.querySelectorAll("tr.row").forEach(r => {
+    const id = r.dataset.machine;
+    const cfg = tpl.content.getElementById("cfg-" + id);
+    const oldRow = rowOf(id);
+    const oldCfg = document.getElementById("cfg-" + id);
+    if (oldCfg && cfg) cfg.style.display = oldCfg.style.display;  // garde un formulaire ouvert
+    if (oldRow) {
+      oldRow.replaceWith(r);
+      if (oldCfg && cfg) oldCfg.replaceWith(cfg);
+    } else {
+      rowsEl.appendChild(r);
+      if (cfg) rowsEl.appendChild(cfg);
+    }
+  });
+}
+
+async function pollDashboard() {
+  try {
+    const resp = await fetch(`/api/dashboard?token=${encodeURIComponent(token)}&since=${encodeURIComponent(dashVersion)}`);
+    if (!resp.ok) return;
+    const d = await resp.json();
+    dashVersion = String(d.version);
+
+    document.getElementById("kpiMachines").textContent = d.kpis.machines;
+    document.getElementById("kpiHours").textContent = d.kpis.total_hours;
+    document.getElementById("kpiJobs").textContent = d.kpis.jobs;
+
+    const rerender = [];
+    d.machines.forEach(m => {
+      const r = rowOf(m.machine_id);
+      if (!r || r.dataset.display !== (m.display_name || "") ||
+          r.dataset.enabled !== String(m.enabled) ||
+          r.dataset.plugins !== m.plugins_required.join(",")) {
+        rerender.push(m.machine_id);
+      } else {
+        patchRow(r, m);
+      }
+    });
+    if (rerender.length) await replaceRows(rerender);
+
+    if (d.machines.length) {
+      refreshDerived();
+      applyFilterSort();
+    }
+  } catch (e) {
+    // réseau coupé : on réessaie au prochain tour
+  }
+}
+
+setInterval(pollDashboard, 5000);